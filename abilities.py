@@ -1,16 +1,16 @@
-from display import SimpleSprite
+from events import Summon
 
 
-class Ability(SimpleSprite):
+class Ability:
     def __init__(self, name, image_name, **kwargs):
-        super().__init__(image_name)
         self.name = name
         self.need_los = False
         self.is_instant = False
         self.image_name = image_name
         self.image_cd = image_name
         self.cooldown = 0
-        self.current_cooldown = 0
+        self.ready_at = 0
+        self.clock = None
         self.ability_range = 0
         self.aoe = 0
         self.power = 0
@@ -19,42 +19,46 @@ class Ability(SimpleSprite):
             setattr(self, k, v)
 
     def range_hint(self, creature, target):
-        if self.need_los:
-            for tile in creature.tile.raycast(target):
-                if tile != target and tile in creature.combat.creatures and creature.combat.creatures[tile].is_pc != creature.is_pc:
-                    return False
-        return creature.tile.dist(target) <= self.ability_range + 0.25
+        if self.need_los and not creature.combat.has_los(creature, target):
+            return False
+        return creature.combat.board.distance(creature.tile, target) <= self.ability_range + 0.25
 
     def splash_hint(self, creature, selected, target):
         return False
 
-    def apply_ability(self, creature, target):
-        self.current_cooldown = self.cooldown
+    @property
+    def current_cooldown(self):
+        """Cooldown left, read from the clock of the combat the ability was last used in."""
+        if not self.clock:
+            return 0
+        return max(0, self.ready_at - self.clock.turn)
+
+    def reset_cooldown(self):
+        self.ready_at = 0
+        self.clock = None
 
-    def tick(self, creature, elapsed_time):
-        self.current_cooldown = max(0, self.current_cooldown - elapsed_time)
+    def apply_ability(self, creature, target):
+        self.clock = creature.combat
+        self.ready_at = creature.combat.turn + self.cooldown
 
 
 class BoltAbility(Ability):
     def is_valid_target(self, creature, target):
         return self.range_hint(creature, target) \
-                and target in creature.combat.creatures \
-                and creature.combat.creatures[target].is_pc != creature.is_pc
+                and creature.combat.is_enemy_at(creature, target)
 
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
         damage = self.power
         for tile in creature.tile.raycast(target, go_through=True):
-            if tile.dist(creature.tile) > self.ability_range + 0.25:
+            if creature.combat.board.distance(tile, creature.tile) > self.ability_range + 0.25:
                 break
-            target_cr = creature.combat.creatures.get(tile, None)
-            if target_cr and target_cr.is_pc != creature.is_pc:
-                target_cr.take_damage(damage, 'magic')
-                # target_cr.game.dmg_log_display.push_line(creature.image_name, self.image_name, damage)
+            if creature.combat.is_enemy_at(creature, tile):
+                creature.combat.creatures[tile].take_damage(damage, 'magic', self)
 
     def splash_hint(self, creature, selected, target):
         for tile in creature.tile.raycast(target, go_through=True):
-            if tile.dist(creature.tile) > self.ability_range + 0.25:
+            if creature.combat.board.distance(tile, creature.tile) > self.ability_range + 0.25:
                 return False
             if tile == target:
                 return True
@@ -63,8 +67,7 @@ class BoltAbility(Ability):
 class DamageAbility(Ability):
     def is_valid_target(self, creature, target):
         return self.range_hint(creature, target) \
-                and target in creature.combat.creatures \
-                and creature.combat.creatures[target].is_pc != creature.is_pc
+                and creature.combat.is_enemy_at(creature, target)
 
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
@@ -73,19 +76,19 @@ class DamageAbility(Ability):
             creature.health = 1
         target_cr = creature.combat.creatures[target]
         damage = self.power
-        target_cr.take_damage(damage, self.damage_type)
-        # creature.combat.dmg_log_display.push_line(creature.image_name, self.image_name, damage)
+        target_cr.take_damage(damage, self.damage_type, self)
 
 
 class AoeAbility(DamageAbility):
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
         damage = round(self.power * self.aoe)
-        for tile in target.neighbours():
-            splash_cr = creature.combat.creatures.get(tile, None)
-            if splash_cr and splash_cr.is_pc != creature.is_pc:
-                splash_cr.take_damage(damage)
-                # creature.combat.dmg_log_display.push_line(creature.image_name, self.image_name, damage)
+        combat = creature.combat
+        i = combat.board.index[target]
+        # Enemies next to target, target itself being excluded
+        enemies = combat.enemy_mask(creature) & ~(1 << i)
+        for cr in combat.spatial.within_steps(i, 1, enemies):
+            cr.take_damage(damage, source=self)
 
     def splash_hint(self, creature, selected, target):
         return target in selected.neighbours()
@@ -94,15 +97,13 @@ class AoeAbility(DamageAbility):
 class ShieldAbility(Ability):
     def is_valid_target(self, creature, target):
         return self.range_hint(creature, target) \
-                and target in creature.combat.creatures \
-                and creature.combat.creatures[target].is_pc == creature.is_pc
+                and creature.combat.is_ally_at(creature, target)
 
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
         power = self.power  # + round(creature.damage * self.damagefactor)
         target_cr = creature.combat.creatures[target]
         target_cr.shield = max(target_cr.shield, power)
-        # creature.combat.log_display.push_text("%s gains a magical shield." % (target_cr.name))
 
 
 class NovaAbility(Ability):
@@ -113,10 +114,8 @@ class NovaAbility(Ability):
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
         damage = self.power
-        for cr in list(creature.combat.creatures.values()):
-            if creature.tile.dist(cr.tile) < self.ability_range + 0.25 and creature.is_pc != cr.is_pc:
-                cr.take_damage(damage, self.damage_type)
-                # creature.combat.dmg_log_display.push_line(creature.image_name, self.image_name, damage)
+        for cr in creature.combat.enemies_within(creature, self.ability_range + 0.25):
+            cr.take_damage(damage, self.damage_type, self)
 
     def splash_hint(self, creature, selected, target):
         return self.range_hint(creature, target)
@@ -128,11 +127,11 @@ class Invocation(Ability):
 
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
-        from creatures import Creature
-        c = Creature(self.defkey)
+        from creatures import POOL
+        c = POOL.spawn(self.defkey, is_pc=creature.is_pc)
         c.set_in_combat(creature.combat, target, creature.next_action + 100)
-        c.is_pc = creature.is_pc
-        # creature.combat.log_display.push_text("%s raises %s !" % (creature.name, c.name))
+        if creature.combat.events:
+            creature.combat.events.emit(Summon(c, creature, target))
 
 
 class StatusAbility(Ability):
@@ -156,22 +155,18 @@ class TeleportAbility(Ability):
 
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
-        creature.combat.creatures[target] = creature
-        del creature.combat.creatures[creature.tile]
-        creature.tile = target
-        creature.rect.x, creature.rect.y = creature.tile.display_location()
+        creature.combat.move_creature(creature, target)
 
 
 class EnnemyStatusAbility(StatusAbility):
     def is_valid_target(self, creature, target):
-        return super().is_valid_target(creature, target) and creature.combat.creatures[target].is_pc != creature.is_pc
+        return self.range_hint(creature, target) and creature.combat.is_enemy_at(creature, target)
 
 
 class ScreamAbility(Ability):
     def is_valid_target(self, creature, target):
         return self.range_hint(creature, target) \
-                and target in creature.combat.creatures \
-                and creature.combat.creatures[target].is_pc != creature.is_pc
+                and creature.combat.is_enemy_at(creature, target)
 
     def apply_ability(self, creature, target):
         super().apply_ability(creature, target)
@@ -179,12 +174,9 @@ class ScreamAbility(Ability):
         from status import STATUSES
         status_class = STATUSES['Silence'][0]
         status_args = STATUSES['Silence'][1]
-        status_effect = status_class(self.duration, *status_args)
-        for cr in list(creature.combat.creatures.values()):
-            if creature.tile.dist(cr.tile) < self.ability_range + 0.25 and creature.is_pc != cr.is_pc:
-                cr.take_damage(damage, 'magic')
-                # creature.combat.dmg_log_display.push_line(creature.image_name, self.image_name, damage)
-                cr.add_status(status_effect)
+        for cr in creature.combat.enemies_within(creature, self.ability_range + 0.25):
+            cr.take_damage(damage, 'magic', self)
+            cr.add_status(status_class(self.duration, *status_args))
 
 
 ABILITIES = {
@@ -0,0 +1,115 @@
+from gametile import GameTile
+
+
+class Board:
+    """Topology of the combat map of a given radius, computed once and shared.
+
+    Tiles are numbered in GameTile.all_tiles order. neighbours[i] lists the
+    indices of the six neighbours of tile i (-1 when off the board), on_edge[i]
+    tells whether tile i has a neighbour off the board, edge_mask being the mask
+    of those tiles, and dist / steps hold the euclidean and hex distances between
+    every pair of tiles. On this board hex distances are also the lengths of the
+    shortest paths staying on it. Tile sets are also handled as int bitmasks,
+    bit i standing for tile i."""
+    _boards = {}
+
+    @staticmethod
+    def of_radius(radius):
+        if radius not in Board._boards:
+            Board._boards[radius] = Board(radius)
+        return Board._boards[radius]
+
+    def __init__(self, radius):
+        self.radius = radius
+        self.tiles = GameTile.all_tiles(radius)
+        self.index = {tile: i for i, tile in enumerate(self.tiles)}
+        self.neighbours = [tuple(self.index.get(n, -1) for n in tile.neighbours()) for tile in self.tiles]
+        self.on_edge = [-1 in neighbours for neighbours in self.neighbours]
+        self.edge_mask = sum(1 << i for i, edge in enumerate(self.on_edge) if edge)
+        self.dist = [[a.dist(b) for b in self.tiles] for a in self.tiles]
+        self.steps = [[a.hex_dist(b) for b in self.tiles] for a in self.tiles]
+        # disks[i][k]: mask of the tiles at most k steps from tile i, k up to the farthest tile
+        self.disks = []
+        for row in self.steps:
+            disks = [0] * (max(row) + 1)
+            for j, k in enumerate(row):
+                disks[k] |= 1 << j
+            for k in range(1, len(disks)):
+                disks[k] |= disks[k - 1]
+            self.disks.append(disks)
+        self._within = {}
+        self._within_mask = {}
+        self._lines = {}
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def contains(self, tile):
+        return tile in self.index
+
+    def distance(self, a, b):
+        """Same as a.dist(b), looked up when both tiles are on the board."""
+        i, j = self.index.get(a), self.index.get(b)
+        if i is None or j is None:
+            return a.dist(b)
+        return self.dist[i][j]
+
+    def within(self, tile, radius):
+        """Board tiles at most radius away from tile, in board order."""
+        key = (tile, radius)
+        if key not in self._within:
+            self._within[key] = tuple(t for t in self.tiles if self.distance(tile, t) <= radius)
+        return self._within[key]
+
+    def within_mask(self, tile, radius):
+        key = (tile, radius)
+        if key not in self._within_mask:
+            self._within_mask[key] = self.mask(self.within(tile, radius))
+        return self._within_mask[key]
+
+    def bit(self, tile):
+        """Mask of the single tile, 0 when it is off the board."""
+        i = self.index.get(tile)
+        return 0 if i is None else 1 << i
+
+    def tiles_of(self, mask):
+        """Tiles of mask, in board order."""
+        tiles = []
+        while mask:
+            low = mask & -mask
+            tiles.append(self.tiles[low.bit_length() - 1])
+            mask ^= low
+        return tiles
+
+    def reach(self, start, max_steps, blocked=0):
+        """Board index -> steps for the tiles at most max_steps away from index start, around blocked tiles."""
+        steps = {start: 0}
+        frontier = [start]
+        for n in range(1, max_steps + 1):
+            next_frontier = []
+            for i in frontier:
+                for j in self.neighbours[i]:
+                    if j >= 0 and j not in steps and not blocked >> j & 1:
+                        steps[j] = n
+                        next_frontier.append(j)
+            frontier = next_frontier
+        return steps
+
+    def mask(self, tiles):
+        """Bitmask of the board tiles among tiles."""
+        mask = 0
+        for tile in tiles:
+            i = self.index.get(tile)
+            if i is not None:
+                mask |= 1 << i
+        return mask
+
+    def line(self, source, target):
+        """Bitmask of the board tiles the raycast from source to target crosses, target excluded.
+
+        Lines are computed for every target at once, the first time a source is asked for."""
+        i = self.index[source]
+        if i not in self._lines:
+            self._lines[i] = [self.mask(t for t in source.raycast(target) if t is not target)
+                              for target in self.tiles]
+        return self._lines[i][self.index[target]]
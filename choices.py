@@ -1,4 +1,3 @@
-import random
 import items
 from pygame.locals import *
 from display import Interface, SimpleSprite, TextSprite, CascadeElement
@@ -13,16 +12,17 @@ def get_question(key):
 
 
 
-def exp_discount():
+def exp_discount(rng):
     i = 1100
-    while random.random() > 0.5:
+    while rng.random() > 0.5:
         i = int(i * 0.85)
-    return random.randint(int(i*0.85), i)
+    return rng.randint(int(i*0.85), i)
 
 
 class Choice:
     def __init__(self, world_interface):
         self.world_interface = world_interface
+        self.rng = world_interface.rng['choices']
         self.rolls = []
         self.roll()
         self._init()
@@ -78,7 +78,7 @@ class FightChoice(Choice):
     REWARD = 30
 
     def roll(self):
-        self.rolls = [random.randint(2,7), random.randint(0,5)]
+        self.rolls = [self.rng.randint(2,7), self.rng.randint(0,5)]
 
     def _init(self):
         self.mobs = [ ('Skeleton', (i, -4 + 0.5 * (i % 2))) for i in range(-self.rolls[0] // 2 + 1, self.rolls[0] // 2 + 1) ]
@@ -96,7 +96,7 @@ class FightChoice(Choice):
 
 class OldManChoice(Choice):
     def roll(self):
-        self.rolls = [random.randint(0,1)]
+        self.rolls = [self.rng.randint(0,1)]
 
     def get_text(self):
         return 'You see an old man far in the mist. Do you want to go greet him ?'
@@ -120,7 +120,7 @@ class OldManChoice(Choice):
 class NecromancerChoice(Choice):
 
     def roll(self):
-        self.rolls = [random.randint(4,7)]
+        self.rolls = [self.rng.randint(4,7)]
 
     def _init(self):
         self.mobs = [ ('Skeleton', (i, -5 + 0.5 * (i % 2))) for i in range(-self.rolls[0] // 2 + 1, self.rolls[0] // 2 + 1) ]
@@ -139,7 +139,7 @@ class NecromancerChoice(Choice):
 class GoodOldManChoice(Choice):
 
     def roll(self):
-        self.rolls = [random.choice( list(items.ITEMS.keys()))]
+        self.rolls = [self.rng.choice( list(items.ITEMS.keys()))]
 
     def get_text(self):
         return 'As you greet him, the old man tells you he is lost and leaves in a nearby village. ' \
@@ -159,7 +159,7 @@ class GoodOldManChoice(Choice):
 class BansheeChoice(Choice):
 
     def roll(self):
-        self.rolls = [random.randint(3, 5)]
+        self.rolls = [self.rng.randint(3, 5)]
 
     def _init(self):
         self.mobs = [('Banshee', (i, -5 + 0.5 * (i % 2))) for i in range(-self.rolls[0] // 2 + 1, self.rolls[0] // 2 + 1)]
@@ -194,7 +194,7 @@ class TollChoice(Choice):
     REWARD = 20
 
     def roll(self):
-        self.rolls = [exp_reward(), random.randint(3,5)]
+        self.rolls = [exp_reward(), self.rng.randint(3,5)]
 
     def _init(self):
         self.mobs = [ ('Gobelin', (i, -5 + 0.5 * (i % 2))) for i in range(-self.rolls[1] // 2 + 1, self.rolls[1] // 2 + 1) ]
@@ -220,7 +220,7 @@ class TollChoice(Choice):
 class ShopChoice(Choice):
 
     def roll(self):
-        self.rolls = [ random.choice( list(items.ITEMS.keys()) ) for _ in range(3)] + [exp_discount() for _ in range(3)]
+        self.rolls = [ self.rng.choice( list(items.ITEMS.keys()) ) for _ in range(3)] + [exp_discount(self.rng) for _ in range(3)]
 
     def _init(self, first=True):
         self.items = []
@@ -298,7 +298,7 @@ class NothingChoice(Choice):
     ]
 
     def roll(self):
-        self.rolls = [random.choice(NothingChoice.TEXTS)]
+        self.rolls = [self.rng.choice(NothingChoice.TEXTS)]
 
     def _init (self):
         pass
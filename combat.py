@@ -1,178 +1,297 @@
-from creatures import Creature
-from combat_ui import *
+from creatures import Creature, POOL
 from gametile import GameTile
-import random
+from board import Board
+from timeline import Timeline
+from rng import RandomStreams
+from events import EventBus, TurnStart, Move, Swap
+from spatial import SpatialIndex
+import heapq
 
 
-class Combat(CascadeElement):
+FORMATION = [(-2, 4), (-1, 4.5), (0, 4), (1, 4.5), (2, 4)]
+
+
+class Combat:
     MAP_RADIUS = 6.4
-    def __init__(self, pc_list, mob_list):
-        super().__init__()
+    def __init__(self, pc_list, mob_list, seed=None):
         self.creatures = {}
+        # Search policies by side, is_pc -> object with a decide(combat) method
+        self.searchers = {}
+        self.rng = RandomStreams(seed)
+        self.board = Board.of_radius(self.MAP_RADIUS)
+        self.timeline = Timeline()
+        self.timers = []
+        self.timer_sequence = 0
+        self.tickers = []
+        # Every creature that entered the fight, dead or alive, in order of arrival
+        self.roster = []
+        # Roster index of the first creature that is not a party member
+        self.party_size = 0
+        self.undo_stack = []
+        # Actions played through act or play since the start of the fight
+        self.history = []
+        self.setup = None
+        self.events = EventBus()
+        # Creatures and bitboards by board index, kept in sync with self.creatures
+        self.spatial = SpatialIndex(self.board)
+        self.occupancy_version = 0
+        self._los = {}
+        self._reach = {}
         self.turn = 0
         self.to_act = None
         self.selected = None
         self.new_turn()
-        self.subsprites = []
         self.spawn_creatures(pc_list, mob_list)
 
     def spawn_creatures(self, pcs, mobs):
+        pcs = list(pcs)
+        # Enough to build the same fight again in another process
+        self.setup = ([(pc.dict_dump(), gt) for pc, gt in pcs], list(mobs), self.rng.seed)
         i = 0
         for pc, gt in pcs:
             if pc.health > 0:
                 pc.set_in_combat(self, GameTile(*gt), i)
             i += 2
+        self.party_size = len(self.roster)
         i = 1
-        mob_zone = [gt for gt in GameTile.all_tiles(self.MAP_RADIUS) if gt.y < -3.25]
+        mob_zone = [gt for gt in self.board.tiles if gt.y < -3.25]
+        rng = self.rng['spawn']
         for mobdef in mobs:
-            gt = random.choice(mob_zone)
+            gt = rng.choice(mob_zone)
             mob_zone.remove(gt)
-            c = Creature(mobdef)
+            c = POOL.spawn(mobdef)
             c.set_in_combat(self, gt, i)
             i += 2
 
     def new_turn(self):
-        if self.is_over():
-            return
-        to_act = min(self.creatures.values(), key=lambda x: x.next_action)
-        if to_act == self.to_act:
-            return
-        self.to_act = to_act
-        elapsed_time = self.to_act.next_action - self.turn
-        for creature in list(self.creatures.values()):
+        while not self.is_over():
+            to_act = self.timeline.peek()
+            if to_act == self.to_act:
+                return
+            self.to_act = to_act
+            self.advance_clock(self.to_act.next_action)
+            if self.events:
+                self.events.emit(TurnStart(to_act, self.turn))
+            # Otherwise the creature to act got killed by a damage over time
+            if self.timeline.peek() == self.to_act:
+                return
+
+    def advance_clock(self, now):
+        """Fires the timers due by now, each at most once, then ticks the passives that asked for it."""
+        elapsed_time = now - self.turn
+        self.turn = now
+        due = []
+        while self.timers and self.timers[0][0] <= now:
+            due.append(heapq.heappop(self.timers))
+        for _, _, status, creature in due:
+            if status not in creature.status:
+                continue
+            status.wake(creature, now)
+            if status in creature.status:
+                self.add_timer(status, creature)
+        for creature in list(self.tickers):
             creature.tick(elapsed_time)
-        # The creature to act got killed by a damage over time
-        if min(self.creatures.values(), key=lambda x: x.next_action) != self.to_act:
-            self.new_turn()
-            return
-        self.turn = self.to_act.next_action
+
+    def add_timer(self, status, creature):
+        self.timer_sequence += 1
+        heapq.heappush(self.timers, (status.next_wake(), self.timer_sequence, status, creature))
+
+    def snapshot(self):
+        """Everything a fight can change, in plain tuples, creatures being listed by roster index."""
+        return (
+            self.turn, self.to_act, tuple(self.creatures.items()),
+            self.timeline.snapshot(), tuple(self.timers), self.timer_sequence, tuple(self.tickers),
+            tuple(creature.snapshot() for creature in self.roster),
+            tuple((name, stream.getstate()) for name, stream in self.rng.streams.items()),
+            len(self.history),
+        )
+
+    def restore(self, snapshot):
+        """Brings the fight back to snapshot, reusing the creature objects.
+
+        Creatures summoned since the snapshot are dropped from the roster."""
+        (self.turn, self.to_act, creatures,
+         timeline, timers, self.timer_sequence, tickers, roster, streams, history_length) = snapshot
+        self.creatures = dict(creatures)
+        self.spatial.load(self.creatures)
+        self.timeline.restore(timeline)
+        self.timers = list(timers)
+        self.tickers = list(tickers)
+        del self.roster[len(roster):]
+        for creature, state in zip(self.roster, roster):
+            creature.restore(state)
+        kept = {}
+        for name, state in streams:
+            kept[name] = self.rng[name]
+            kept[name].setstate(state)
+        self.rng.streams = kept
+        del self.history[history_length:]
+        self.occupancy_changed()
+
+    def release(self):
+        """Gives the mobs and summons back to creatures.POOL once the fight is done with.
+
+        The combat, its snapshots and the events it emitted must not be used afterwards."""
+        POOL.release(self.roster[self.party_size:])
+        del self.roster[self.party_size:]
+        self.creatures = {}
+        self.undo_stack = []
+
+    def push(self):
+        """Saves the state on the undo stack, for pop to come back to it."""
+        self.undo_stack.append(self.snapshot())
+
+    def pop(self):
+        self.restore(self.undo_stack.pop())
+
+    def place_creature(self, creature, tile):
+        creature.tile = tile
+        self.creatures[tile] = creature
+        self.spatial.add(creature, self.board.index[tile])
+        self.occupancy_changed()
+
+    def remove_creature(self, creature):
+        del self.creatures[creature.tile]
+        self.spatial.remove(creature, self.board.index[creature.tile])
+        self.occupancy_changed()
+
+    def move_creature(self, creature, tile):
+        """Moves creature to tile, swapping places with the creature standing there if any."""
+        source, destination = self.board.index[creature.tile], self.board.index[tile]
+        other = self.creatures.pop(tile, None)
+        self.spatial.remove(creature, source)
+        if other:
+            self.spatial.remove(other, destination)
+            other.tile = creature.tile
+            self.creatures[other.tile] = other
+            self.spatial.add(other, source)
+        else:
+            del self.creatures[creature.tile]
+        if self.events:
+            self.events.emit(Swap(creature, other, other.tile, tile) if other else Move(creature, creature.tile, tile))
+        creature.tile = tile
+        self.creatures[tile] = creature
+        self.spatial.add(creature, destination)
+        self.occupancy_changed()
+
+    @property
+    def occupied(self):
+        return self.spatial.occupied
+
+    @property
+    def pc_mask(self):
+        return self.spatial.pc_mask
+
+    @property
+    def mob_mask(self):
+        return self.spatial.mob_mask
+
+    def occupancy_changed(self):
+        """Forgets everything computed from the creature positions."""
+        self.occupancy_version += 1
+        self._los = {}
+        self._reach = {}
+
+    def side_mask(self, is_pc):
+        return self.spatial.pc_mask if is_pc else self.spatial.mob_mask
+
+    def enemy_mask(self, creature):
+        return self.spatial.mob_mask if creature.is_pc else self.spatial.pc_mask
+
+    def is_enemy_at(self, creature, tile):
+        return bool(self.enemy_mask(creature) & self.board.bit(tile))
+
+    def is_ally_at(self, creature, tile):
+        return bool(self.side_mask(creature.is_pc) & self.board.bit(tile))
+
+    def enemies_within(self, creature, radius, tile=None):
+        """Enemies of creature at most radius away from tile, its own by default, in board order."""
+        return self.spatial.within(tile or creature.tile, radius, self.enemy_mask(creature))
+
+    def nearest_enemy(self, creature):
+        """Enemy of creature at the least distance, the first one in self.creatures on ties, or None."""
+        index = self.board.index
+        dist = self.board.dist[index[creature.tile]]
+        enemies = [c for c in self.creatures.values() if c.is_pc != creature.is_pc]
+        return min(enemies, key=lambda c: dist[index[c.tile]], default=None)
+
+    def has_los(self, creature, target):
+        """Whether no enemy of creature stands between it and target."""
+        key = (creature.tile, target, creature.is_pc)
+        if key not in self._los:
+            self._los[key] = not self.board.line(creature.tile, target) & self.enemy_mask(creature)
+        return self._los[key]
+
+    def reach(self, creature):
+        """Tiles creature can move to before its act ends, board index -> moves, its own tile at 0.
+
+        Every move but the last one spends a free move. Enemies block the way, allies are
+        swapped places with, and a rooted creature stays put. Kept until a creature moves."""
+        key = (creature, creature.free_moves, bool(creature.rooted))
+        if key not in self._reach:
+            moves = 0 if creature.rooted else creature.free_moves + 1
+            self._reach[key] = self.board.reach(self.board.index[creature.tile], moves, self.enemy_mask(creature))
+        return self._reach[key]
 
     def is_over(self):
-        return all((c.is_pc for c in self.creatures.values())) or all((not c.is_pc for c in self.creatures.values()))
+        return not self.pc_mask or not self.mob_mask
 
     def get_valid_targets(self, creature, ability):
-        valid_targets = [tile for tile in GameTile.all_tiles(self.MAP_RADIUS) if ability.is_valid_target(creature, tile)]
+        # Every ability targets within its range, the caster's own tile included
+        in_range = self.board.within(creature.tile, ability.ability_range + 0.25)
+        valid_targets = [tile for tile in in_range if ability.is_valid_target(creature, tile)]
         return valid_targets
 
     def get_range_hint(self, creature, ability):
-        valid_range = [tile for tile in GameTile.all_tiles(self.MAP_RADIUS) if ability.range_hint(creature, tile)]
+        in_range = self.board.within(creature.tile, ability.ability_range + 0.25)
+        valid_range = [tile for tile in in_range if ability.range_hint(creature, tile)]
         return valid_range
 
     def get_splash_hint(self, creature, ability, selected):
-        valid_range = [tile for tile in GameTile.all_tiles(self.MAP_RADIUS) if ability.splash_hint(creature, selected, tile)]
+        valid_range = [tile for tile in self.board.tiles if ability.splash_hint(creature, selected, tile)]
         return valid_range
     
-    def apply_ability(self, ability, creature, target):
-        creature.use_ability(ability, target)
-        self.new_turn()
-    
-    def update(self):
-        for cr in self.creatures.values():
-            cr.update()
+    def legal_actions(self):
+        """Every action the creature to act can take that does something."""
+        creature = self.to_act
+        i = self.board.index[creature.tile]
+        neighbours = self.board.neighbours[i]
+        # Only the tiles on the edge have neighbours off the board
+        if self.board.edge_mask >> i & 1:
+            neighbours = [j for j in neighbours if j >= 0]
+        if creature.rooted:
+            enemies = self.enemy_mask(creature)
+            neighbours = [j for j in neighbours if enemies >> j & 1]
+        actions = [('move', self.board.tiles[j]) for j in neighbours]
+        actions.append(('idle',))
+        if not creature.silenced:
+            for i, ability in enumerate(creature.abilities):
+                if ability.current_cooldown == 0:
+                    actions += [('ability', i, target) for target in self.get_valid_targets(creature, ability)]
+        return actions
 
+    def act(self, action):
+        """Has the creature to act perform action, the turn passing on at the next new_turn."""
+        self.history.append(action)
+        self.to_act.perform(action)
 
-class CombatInterface (Interface):
-    def __init__ (self, father, mob_list):
-        self.combat = Combat(zip(father.pc_list, father.formation), mob_list)
-        self.combat.new_turn()
-        self.combat_ui = GameUI(self.combat)
-        self.selected = None
-        super().__init__(father, keys=[
-            ('[1-3]', self.ability,),
-            ('(up|down)(left|right)?', self.go),
-            ('0', self.pass_turn),
-            ('\?', self.disp_help),
-            (K_ESCAPE, self.quit)])
-
-    def go(self, code):
-        if not self.combat.to_act or not self.combat.to_act.is_pc:
-            return
-        moves = {
-            'down': 1,
-            'downleft': 0,
-            'downright': 2,
-            'up': 4,
-            'upright': 5,
-            'upleft': 3
-        }
-        index = moves[code]
-        self.combat.to_act.move_or_attack(self.combat.to_act.tile.neighbours()[index])
-        self.combat.new_turn()
-        if self.combat.is_over():
-            self.done()
-            return
-
-    def pass_turn(self, _):
-        if not self.combat.to_act or not self.combat.to_act.is_pc:
-            return
-        self.combat.to_act.idle()
-        self.combat.new_turn()
-
-    def ability(self, key):
-        if not self.combat.to_act or not self.combat.to_act.is_pc:
-            return
-        if len(self.combat.to_act.abilities) < int(key):
-            self.combat_ui.log_display.push_text('Unknown ability')
-            return
-        if self.combat.to_act.silenced:
-            self.combat_ui.log_display.push_text('Not while silenced !')
-            return
-        if self.combat.to_act.abilities[int(key) - 1].current_cooldown > 0:
-            self.combat_ui.log_display.push_text('Ability is currently in cooldown')
-            return
-        pc = self.combat.to_act
-        ability = pc.abilities[int(key) - 1]
-        valid_targets = self.combat.get_valid_targets(self.combat.to_act, ability)
-        if not valid_targets:
-            self.combat_ui.log_display.push_text('No valid target.')
-            return
-        t = TargetInterface(self, valid_targets, ability)
-        t.activate()
-        self.desactivate()
-
-    def on_click(self, mouse_pos):
-        tile = GameTile.get_tile_for_mouse(mouse_pos)
-        if self.combat.selected and self.combat.selected == tile:
-            self.combat.selected = None
-        else:
-            self.combat.selected = tile
-
-    def quit(self, _):
-        qi = QuitInterface(self)
-        qi.activate()
-        self.desactivate()
-
-    def disp_help(self, _):
-        hi = HelpInterface(self)
-        hi.activate()
-        self.desactivate()
-
-    def on_return(self, defunct=None):
-        if getattr(defunct, 'target', None):
-            self.combat.apply_ability(defunct.ability, self.combat.to_act, defunct.target)
-        self.combat_ui.cursor.animate('icons/magnifyingglass.png')
-        if self.combat.is_over():
-            self.done()
-
-    def update(self, mouse_pos):
-        if self.combat.is_over():
-            self.done()
-            return
-        self.combat_ui.to_act_display.update(self.combat)
-        if not self.combat.to_act.is_pc and self.combat_ui.game_frame == 5:
-            self.combat.to_act.ai_play()
-        elif self.combat_ui.game_frame > 10:
-            self.combat.new_turn()
-            self.combat_ui.game_frame = 0
-
-        self.combat.update()
-        self.combat_ui.update(self.combat, mouse_pos)
-
-        self.combat_ui.display()
-
-    def done(self):
-        for creature in self.combat.creatures.values():
-            creature.end_combat()
-        super().done()
-    
+    def play(self, action):
+        self.act(action)
+        self.new_turn()
+
+    def ai_action(self):
+        """What the AI plays for the creature to act, searched when its side has a searcher."""
+        searcher = self.searchers.get(self.to_act.is_pc)
+        if searcher:
+            return searcher.decide(self)
+        return self.to_act.ai_action()
 
+    @staticmethod
+    def replay(setup, history, combat_class=None):
+        """Builds the fight of setup again and plays history in it."""
+        pcs, mobs, seed = setup
+        combat = (combat_class or Combat)([(Creature.dict_load(pc, []), gt) for pc, gt in pcs], mobs, seed)
+        combat.new_turn()
+        for action in history:
+            combat.play(action)
+        return combat
@@ -2,18 +2,73 @@ from display import *
 from math import ceil
 from pygame.locals import *
 from gametile import GameTile
+from board import Board
+from combat import Combat
+from creatures import Creature
+from abilities import Ability
+from events import Attack, Cast, Damage, Death, Summon, StatusApply
+import replay
+import os
 
 
-def dfs(creature, tile, maxdepth, radius, visited=None):
-    if not visited:
-        visited = {tile}
-    if maxdepth == 0:
-        return visited
-    for neighb in tile.neighbours():
-        if neighb.in_boundaries(radius) and (neighb not in creature.combat.creatures or creature.combat.creatures[neighb].is_pc):
-            visited.add(neighb)
-            dfs(creature, neighb, maxdepth - 1, radius, visited)
-    return visited
+class SideHealthGauge(Gauge):
+    def __init__(self, creature):
+        self.creature = creature
+        super().__init__(4, 32, '#BB0008')
+
+    def update(self):
+        self.height = ceil((16 * self.creature.health) / self.creature.maxhealth) * 2
+        self.rect.x, self.rect.y = self.creature.tile.display_location()
+        self.rect.y += 32 - self.height
+        self.set_height(self.height)
+        if self.creature.health == self.creature.maxhealth:
+            self.set_height(0)
+
+
+class SideShieldGauge(Gauge):
+    def __init__(self, creature):
+        self.creature = creature
+        super().__init__(4, 32, '#BBCCFF')
+
+    def update(self):
+        self.height = ceil((16 * self.creature.shield) / self.creature.maxhealth) * 2
+        self.rect.x, self.rect.y = self.creature.tile.display_location()
+        self.rect.y += 32 - self.height
+        self.set_height(self.height)
+
+
+class CreatureSprite(SimpleSprite, CascadeElement):
+    """View of a creatures.Creature, only built when the creature has to be drawn."""
+    def __init__(self, creature):
+        CascadeElement.__init__(self)
+        SimpleSprite.__init__(self, creature.image_name)
+        self.creature = creature
+        self.frames = []
+        self.last_health = creature.health + creature.shield
+        self.health_gauge = SideHealthGauge(creature)
+        self.shield_gauge = SideShieldGauge(creature)
+        self.subsprites = [self.health_gauge, self.shield_gauge]
+
+    def update(self):
+        self.must_show = self.creature.health > 0
+        if not self.must_show:
+            return
+        health = self.creature.health + self.creature.shield
+        if health < self.last_health:
+            self.frames.extend(['tiles/Hit.png', self.creature.image_name])
+        self.last_health = health
+        if self.frames:
+            self.animate(self.frames.pop(0))
+        self.rect.x, self.rect.y = self.creature.tile.display_location()
+        self.health_gauge.update()
+        self.shield_gauge.update()
+
+    def display(self):
+        if not self.must_show:
+            return
+        if self.creature.combat:
+            CascadeElement.display(self)
+        SimpleSprite.display(self)
 
 
 class Arena(CascadeElement):
@@ -21,19 +76,32 @@ class Arena(CascadeElement):
         super().__init__()
         self.radius = radius
         self.board = {}
-        for tile in GameTile.all_tiles(radius):
+        for tile in Board.of_radius(radius).tiles:
             self.board[tile] = SimpleSprite('tiles/GreyTile.png')
             self.board[tile].rect.move_ip(*tile.display_location())
         self.subsprites = list(self.board.values())
+        # What the highlight was drawn for, to skip frames where it is the same
+        self.shown = None
 
     def update(self, creature):
+        combat = creature.combat
+        shown = (creature, combat.occupancy_version, creature.free_moves, bool(creature.rooted))
+        if shown == self.shown:
+            return
+        self.shown = shown
         for sprite in self.board.values():
             sprite.animate('tiles/GreyTile.png')
         if creature.is_pc:
-            for tile in dfs(creature, creature.tile, creature.free_moves + 1, self.radius):
-                self.board[tile].animate('tiles/Green1.png')
+            for i in combat.reach(creature):
+                self.board[combat.board.tiles[i]].animate('tiles/Green1.png')
         self.board[creature.tile].animate('tiles/Green2.png')
 
+    def overlay(self, tiles, frame_name):
+        """Animates tiles over the highlight, which is then drawn again at the next update."""
+        for tile in tiles:
+            self.board[tile].animate(frame_name)
+        self.shown = None
+
 
 class InfoDisplay (CascadeElement):
     def __init__ (self, basex, basey):
@@ -239,6 +307,10 @@ class DamageLogDisplay (CascadeElement):
         self.subsprites = []
 
     def update(self):
+        self.layout()
+        self.display()
+
+    def layout(self):
         self.subsprites = []
         for i, line in enumerate(self.lines):
             if line[0]:
@@ -250,11 +322,11 @@ class DamageLogDisplay (CascadeElement):
             if line[2]:
                 self.number_sprites[i].set_text(str(line[2]))
                 self.subsprites.append(self.number_sprites[i])
-        self.display()
 
     def push_line(self, image1, image2, number):
         self.lines.append((image1, image2, number))
         self.lines.pop(0)
+        self.layout()
 
 
 class NextToActDisplay (CascadeElement):
@@ -264,7 +336,7 @@ class NextToActDisplay (CascadeElement):
         self.basex, self.basey = 904, 92
 
     def update(self, combat):
-        to_act = sorted(combat.creatures.values(), key= lambda x: x.next_action) * 2
+        to_act = combat.timeline.upcoming(14) * 2
         self.subsprites = []
         for actor in to_act[:14]:
             self.subsprites.append(SimpleSprite(actor.image_name))
@@ -286,11 +358,16 @@ class StepHint(CascadeElement):
             self.must_show = False
             return
         self.must_show = True
-        for i, neighbour in enumerate(creature.tile.neighbours()):
-            if not neighbour.in_boundaries(creature.combat.MAP_RADIUS) or neighbour in creature.combat.creatures:
+        board = creature.combat.board
+        index = board.index[creature.tile]
+        occupied = creature.combat.occupied
+        # Only the tiles on the edge have neighbours off the board
+        on_edge = board.edge_mask >> index & 1
+        for i, j in enumerate(board.neighbours[index]):
+            if on_edge and j < 0 or occupied >> j & 1:
                 self.subsprites[i].must_show = False
                 continue
-            x, y = neighbour.display_location()
+            x, y = board.tiles[j].display_location()
             self.subsprites[i].textsprites[0].rect.x, self.subsprites[i].textsprites[0].rect.y = x + 4, y + 6
             self.subsprites[i].must_show = True
 
@@ -374,11 +451,9 @@ class TargetInterface(Interface):
         self.updates += 1
         self.father.combat_ui.update(self.father.combat, mouse_pos)
         range_hint = self.father.combat.get_range_hint(self.father.combat.to_act, self.ability)
-        for target in range_hint:
-            self.father.combat_ui.arena.board[target].animate('tiles/GreyTile2.png')
+        self.father.combat_ui.arena.overlay(range_hint, 'tiles/GreyTile2.png')
         splash_hint = self.father.combat.get_splash_hint(self.father.combat.to_act, self.ability, self.target)
-        for target in splash_hint:
-            self.father.combat_ui.arena.board[target].animate('tiles/Yellow2.png')
+        self.father.combat_ui.arena.overlay(splash_hint, 'tiles/Yellow2.png')
         targets_hint = []
         backgrounds = []
         for i, target in enumerate(self.valid_targets):
@@ -449,10 +524,32 @@ class GameUI(CascadeElement):
         self.selected_xair = HoverXair('icons/select.png')
         self.subsprites = [self.bg, self.arena, self.log_display, self.dmg_log_display, self.to_act_display,
                            self.hover_display, self.hover_xair, self.selected_xair, self.cursor]
+        self.creature_sprites = {}
         for c in combat.creatures.values():
-            self.subsprites.insert(3, c)
+            self.add_creature(c)
         self.log_display.push_text('Press [?] for help and keybindings')
         self.game_frame = 0
+        # Creature whose attack or ability deals the damage events that follow
+        self.author = None
+        combat.events.subscribe(self.on_event, Attack, Cast, Damage, Death, Summon, StatusApply)
+
+    def on_event(self, event):
+        """Writes the combat events to the logs."""
+        if isinstance(event, (Attack, Cast)):
+            self.author = event.creature
+        elif isinstance(event, Damage):
+            if isinstance(event.source, Creature):
+                self.dmg_log_display.push_line(event.source.image_name, 'icons/sword.png', event.amount)
+            else:
+                # Statuses hurt the creature they are on
+                author = self.author if isinstance(event.source, Ability) else event.target
+                self.dmg_log_display.push_line(author.image_name, event.source.image_name, event.amount)
+        elif isinstance(event, Death):
+            self.log_display.push_text('%s dies.' % event.creature.name)
+        elif isinstance(event, Summon):
+            self.log_display.push_text('%s raises %s !' % (event.summoner.name, event.creature.name))
+        else:
+            self.log_display.push_text('%s is affected by %s.' % (event.target.name, event.status.name))
 
     def update(self, combat, mouse_pos):
         self.game_frame += 1
@@ -461,8 +558,10 @@ class GameUI(CascadeElement):
         self.hover_xair.update(tile)
         self.selected_xair.update(combat.selected)
         for creature in combat.creatures.values():
-            if creature not in self.subsprites:
-                self.subsprites.insert(3, creature)
+            if creature not in self.creature_sprites:
+                self.add_creature(creature)
+        for sprite in self.creature_sprites.values():
+            sprite.update()
         creature = combat.creatures.get(tile, combat.creatures.get(combat.selected, combat.to_act))
         if creature:
             self.hover_display.update(creature, mouse_pos)
@@ -471,4 +570,143 @@ class GameUI(CascadeElement):
             self.hover_display.must_show = False
         self.arena.update(combat.to_act)
 
+    def add_creature(self, creature):
+        self.creature_sprites[creature] = CreatureSprite(creature)
+        self.subsprites.insert(3, self.creature_sprites[creature])
+
+
+class CombatInterface (Interface):
+    # Directory where every fight is saved as a replay file, when set
+    archive = None
+
+    def __init__ (self, father, mob_list, seed=None):
+        self.combat = Combat(zip(father.pc_list, father.formation), mob_list, seed)
+        self.combat.new_turn()
+        self.combat_ui = GameUI(self.combat)
+        self.selected = None
+        super().__init__(father, keys=[
+            ('[1-3]', self.ability,),
+            ('(up|down)(left|right)?', self.go),
+            ('0', self.pass_turn),
+            (r'\?', self.disp_help),
+            (K_ESCAPE, self.quit)])
+
+    def go(self, code):
+        if not self.combat.to_act or not self.combat.to_act.is_pc:
+            return
+        moves = {
+            'down': 1,
+            'downleft': 0,
+            'downright': 2,
+            'up': 4,
+            'upright': 5,
+            'upleft': 3
+        }
+        index = moves[code]
+        self.combat.play(('move', self.combat.to_act.tile.neighbours()[index]))
+        if self.combat.is_over():
+            self.done()
+            return
+
+    def pass_turn(self, _):
+        if not self.combat.to_act or not self.combat.to_act.is_pc:
+            return
+        self.combat.play(('idle',))
+
+    def ability(self, key):
+        if not self.combat.to_act or not self.combat.to_act.is_pc:
+            return
+        if len(self.combat.to_act.abilities) < int(key):
+            self.combat_ui.log_display.push_text('Unknown ability')
+            return
+        if self.combat.to_act.silenced:
+            self.combat_ui.log_display.push_text('Not while silenced !')
+            return
+        if self.combat.to_act.abilities[int(key) - 1].current_cooldown > 0:
+            self.combat_ui.log_display.push_text('Ability is currently in cooldown')
+            return
+        pc = self.combat.to_act
+        ability = pc.abilities[int(key) - 1]
+        valid_targets = self.combat.get_valid_targets(self.combat.to_act, ability)
+        if not valid_targets:
+            self.combat_ui.log_display.push_text('No valid target.')
+            return
+        t = TargetInterface(self, valid_targets, ability)
+        t.activate()
+        self.desactivate()
+
+    def on_click(self, mouse_pos):
+        tile = GameTile.get_tile_for_mouse(mouse_pos)
+        if self.combat.selected and self.combat.selected == tile:
+            self.combat.selected = None
+        else:
+            self.combat.selected = tile
+
+    def quit(self, _):
+        qi = QuitInterface(self)
+        qi.activate()
+        self.desactivate()
+
+    def disp_help(self, _):
+        hi = HelpInterface(self)
+        hi.activate()
+        self.desactivate()
+
+    def on_return(self, defunct=None):
+        if getattr(defunct, 'target', None):
+            pc = self.combat.to_act
+            self.combat.play(('ability', pc.abilities.index(defunct.ability), defunct.target))
+        self.combat_ui.cursor.animate('icons/magnifyingglass.png')
+        if self.combat.is_over():
+            self.done()
+
+    def update(self, mouse_pos):
+        if self.combat.is_over():
+            self.done()
+            return
+        self.combat_ui.to_act_display.update(self.combat)
+        if not self.combat.to_act.is_pc and self.combat_ui.game_frame == 5:
+            self.combat.act(self.combat.ai_action())
+        elif self.combat_ui.game_frame > 10:
+            self.combat.new_turn()
+            self.combat_ui.game_frame = 0
+
+        self.combat_ui.update(self.combat, mouse_pos)
+
+        self.combat_ui.display()
+
+    def done(self):
+        if self.archive:
+            replay.save(self.combat, os.path.join(self.archive, '%s.hxr' % self.combat.rng.seed))
+        for creature in self.combat.creatures.values():
+            creature.end_combat()
+        self.combat.release()
+        super().done()
+
+
+class ReplayInterface(Interface):
+    """Plays a replay.Replay back from combat, one of its positions: [n] next action, [p] previous one."""
+    def __init__(self, replay, combat, father=None):
+        self.replay = replay
+        self.combat = combat
+        self.combat_ui = GameUI(combat)
+        super().__init__(father, keys=[
+            ('n', self.next),
+            ('p', self.previous),
+            (K_ESCAPE, self.quit)])
+
+    def next(self, _):
+        if len(self.combat.history) < len(self.replay):
+            self.combat.play(self.replay.actions[len(self.combat.history)])
+
+    def previous(self, _):
+        self.combat = self.replay.seek(len(self.combat.history) - 1)
+        self.combat_ui = GameUI(self.combat)
 
+    def quit(self, _):
+        self.done()
+
+    def update(self, mouse_pos):
+        self.combat_ui.to_act_display.update(self.combat)
+        self.combat_ui.update(self.combat, mouse_pos)
+        self.combat_ui.display()
@@ -1,109 +1,159 @@
-from display import SimpleSprite, CascadeElement, Gauge
 from abilities import ABILITIES
-from passives import PASSIVES
+from passives import PASSIVES, HOOKS, dispatch_table
 from items import ITEMS
-import random
-import math
+from events import Attack, Cast, Damage, ShieldAbsorb, StatusApply, Death
 
+STATS = ('name', 'health', 'damage', 'armor', 'magic_resist', 'is_ranged', 'image_name', 'portrait', 'description')
 
-class SideHealthGauge(Gauge):
-    def __init__(self, creature):
-        self.creature = creature
-        super().__init__(4, 32, '#BB0008')
 
-    def update(self):
-        self.height = math.ceil((16 * self.creature.health) / self.creature.maxhealth) * 2
-        self.rect.x, self.rect.y = self.creature.tile.display_location()
-        self.rect.y += 32 - self.height
-        self.set_height(self.height)
-        if self.creature.health == self.creature.maxhealth:
-            self.set_height(0)
+class Prototype:
+    """A DEFS entry checked and built once, copied into every creature spawned from it.
 
+    DEFS itself is only read, abilities and passives being built from merged copies of their kwargs."""
+    def __init__(self, defkey):
+        definition = DEFS[defkey]
+        unknown = set(definition) - set(STATS) - {'abilities', 'passives'}
+        if unknown:
+            raise ValueError('%s: unknown keys %s' % (defkey, ', '.join(sorted(unknown))))
+        self.stats = {'health': 0, 'damage': 0, 'armor': 0, 'magic_resist': 0, 'is_ranged': False}
+        self.stats.update((k, v) for k, v in definition.items() if k in STATS)
+        self.abilities = [build(ABILITIES, defkey, key, kwargs) for key, kwargs in definition.get('abilities', ())]
+        self.passives = [build(PASSIVES, defkey, key, kwargs) for key, kwargs in definition.get('passives', ())]
+        # dispatch_table as hook name -> indices in passives, to bind the copies quickly
+        self.hooks = []
+        for name in HOOKS:
+            indices = [i for i, passive in enumerate(self.passives) if hasattr(passive, name)]
+            if indices:
+                self.hooks.append((name, indices))
+
+    def fill(self, creature, recycled=False):
+        """Sets the stats, abilities and passives of creature. A recycled creature keeps its ability objects."""
+        for k, v in self.stats.items():
+            setattr(creature, k, v)
+        creature.maxhealth = creature.health
+        if recycled:
+            for ability in creature.abilities:
+                ability.reset_cooldown()
+        else:
+            creature.abilities = [clone(ability) for ability in self.abilities]
+        passives = creature.passives = [clone(passive) for passive in self.passives]
+        creature.max_free_moves = Creature.FREE_MOVES
+        for passive in passives:
+            passive.apply_to(creature)
+        creature.free_moves = creature.max_free_moves
+        # Hook name -> bound hooks of the passives, see passives.HOOKS
+        creature.hooks = {name: tuple(getattr(passives[i], name) for i in indices) for name, indices in self.hooks}
+
+
+def build(registry, defkey, key, kwargs):
+    if key not in registry:
+        raise ValueError('%s: unknown ability or passive %s' % (defkey, key))
+    template, defaults = registry[key]
+    # As the registry defaults used to be merged over the creature's kwargs, they win
+    return template(**dict(kwargs, **defaults))
+
+
+def clone(obj):
+    """Shallow copy of an ability or passive, without copy.copy's reduce protocol."""
+    new = obj.__class__.__new__(obj.__class__)
+    new.__dict__.update(obj.__dict__)
+    return new
+
+
+PROTOTYPES = {}
 
-class SideShieldGauge(Gauge):
-    def __init__(self, creature):
-        self.creature = creature
-        super().__init__(4, 32, '#BBCCFF')
 
-    def update(self):
-        self.height = math.ceil((16 * self.creature.shield) / self.creature.maxhealth) * 2
-        self.rect.x, self.rect.y = self.creature.tile.display_location()
-        self.rect.y += 32 - self.height
-        self.set_height(self.height)
+def prototype(defkey):
+    """The Prototype of defkey, built on first use."""
+    if defkey not in PROTOTYPES:
+        PROTOTYPES[defkey] = Prototype(defkey)
+    return PROTOTYPES[defkey]
 
 
-class Creature(SimpleSprite, CascadeElement):
+class CreaturePool:
+    """Creatures of finished fights by defkey, handed out again instead of building new ones.
+
+    Only creatures no fight, snapshot or replay refers to anymore may be released:
+    see Combat.release. At most limit creatures are kept per defkey."""
+    def __init__(self, limit=64):
+        self.limit = limit
+        self.free = {}
+        self.hits = 0
+        self.misses = 0
+
+    def spawn(self, defkey, is_pc=False):
+        free = self.free.get(defkey)
+        if free:
+            self.hits += 1
+            creature = free.pop()
+            creature.recycle(is_pc)
+            return creature
+        self.misses += 1
+        return Creature(defkey, is_pc)
+
+    def release(self, creatures):
+        for creature in creatures:
+            free = self.free.setdefault(creature.defkey, [])
+            if len(free) < self.limit:
+                free.append(creature)
+
+    def clear(self):
+        self.free = {}
+        self.hits = self.misses = 0
+
+
+class Creature:
     FREE_MOVES = 1
+    __slots__ = STATS + ('maxhealth', 'passives', 'hooks', 'status', 'abilities', 'items', 'rooted', 'silenced',
+                         'tile', 'combat', 'next_action', 'free_moves', 'max_free_moves', 'shield', 'is_pc', 'defkey')
     def __init__(self, defkey, is_pc=False):
-        CascadeElement.__init__(self)
-        self.is_ranged = False
-        self.health = 0
-        self.maxhealth = 0
-        self.damage = 0
-        self.armor = 0
-        self.magic_resist = 0
-        self.passives = []
+        self.defkey = defkey
+        self.reset_state(is_pc)
+        prototype(defkey).fill(self)
+
+    def reset_state(self, is_pc):
         self.status = []
-        self.abilities = []
         self.items = []
         self.rooted = []
         self.silenced = []
-        self.frames = []
         self.tile = None
         self.combat = None
         self.next_action = 0
-        self.free_moves = self.FREE_MOVES
         self.shield = 0
         self.is_pc = is_pc
-        self.defkey = defkey
-        self.health_gauge = SideHealthGauge(self)
-        self.shield_gauge = SideShieldGauge(self)
-        self.load_def(defkey)
-
-    def load_def(self, defkey):
-        for k, v in DEFS[defkey].items():
-            setattr(self, k, v)
-        creature_passive_def = [k[1] for k in self.passives]
-        self.passives = [PASSIVES[k[0]] for k in self.passives]
-        for c_def, passive_template in zip(creature_passive_def, self.passives):
-            c_def.update(passive_template[1])
-        self.passives = [template[0](**c_def) for template, c_def in zip(self.passives, creature_passive_def)]
-        for passive in self.passives:
-            passive.apply_to(self)
-        creature_ability_def = [k[1] for k in self.abilities]
-        self.abilities = [ABILITIES[k[0]] for k in self.abilities]
-        for c_def, ability_template in zip(creature_ability_def, self.abilities):
-            c_def.update(ability_template[1])
-        self.abilities = [template[0](**c_def) for template, c_def in zip(self.abilities, creature_ability_def)]
-        self.maxhealth = self.health
-        SimpleSprite.__init__(self, DEFS[defkey]['image_name'])
-        self.subsprites = [self.health_gauge, self.shield_gauge]
+
+    def recycle(self, is_pc=False):
+        """Back to a new creature of its defkey, for CreaturePool."""
+        self.reset_state(is_pc)
+        prototype(self.defkey).fill(self, recycled=True)
 
     def set_in_combat(self, combat, game_tile, next_action):
-        self.tile = game_tile
-        self.rect.x, self.rect.y = self.tile.display_location()
         self.combat = combat
-        self.combat.creatures[game_tile] = self
+        self.combat.roster.append(self)
+        self.combat.place_creature(self, game_tile)
         self.next_action = next_action
+        self.combat.timeline.schedule(self)
+        if 'on_tick' in self.hooks:
+            self.combat.tickers.append(self)
         self.shield = 0
-        self.free_moves = self.FREE_MOVES
+        self.free_moves = self.max_free_moves
         self.status = []
 
+    def set_passives(self, passives):
+        self.passives = passives
+        self.hooks = dispatch_table(passives)
+
     def end_combat(self):
+        for hook in self.hooks.get('on_end_combat', ()):
+            hook(self)
         for status in self.status:
             status.status_end(self)
         for ability in self.abilities:
-            ability.current_cooldown = 0
+            ability.reset_cooldown()
         self.status = []
         self.combat = None
         self.tile = None
 
-    def update(self):
-        if self.frames:
-            self.animate(self.frames.pop(0))
-        self.health_gauge.update()
-        self.shield_gauge.update()
-
     def dict_dump(self):
         items = self.items.copy()
         # This is so we dont stack stats by saving/loading with, say, a health amulet
@@ -138,11 +188,31 @@ class Creature(SimpleSprite, CascadeElement):
     
     # Below this : only valid if previously set_in_combat
 
+    def snapshot(self):
+        return (self.health, self.maxhealth, self.damage, self.armor, self.magic_resist,
+                self.shield, self.free_moves, self.next_action, self.tile,
+                tuple((status, dict(vars(status))) for status in self.status),
+                tuple(self.rooted), tuple(self.silenced), tuple(self.passives),
+                tuple((ability.ready_at, ability.clock) for ability in self.abilities))
+
+    def restore(self, state):
+        (self.health, self.maxhealth, self.damage, self.armor, self.magic_resist,
+         self.shield, self.free_moves, self.next_action, self.tile,
+         status, rooted, silenced, passives, cooldowns) = state
+        for status_effect, attributes in status:
+            vars(status_effect).update(attributes)
+        self.status = [status_effect for status_effect, _ in status]
+        self.rooted = list(rooted)
+        self.silenced = list(silenced)
+        self.set_passives(list(passives))
+        for ability, (ready_at, clock) in zip(self.abilities, cooldowns):
+            ability.ready_at = ready_at
+            ability.clock = clock
+
     def tick(self, elapsed_time):
-        for ability in self.abilities:
-            ability.tick(self, elapsed_time)
-        for status in self.status.copy():
-            status.tick(self, elapsed_time)
+        """Cooldowns and statuses are read from the combat clock, this is only a hook for passives."""
+        for hook in self.hooks.get('on_tick', ()):
+            hook(self, elapsed_time)
 
     def step_to(self, target):
         return min(self.tile.neighbours(), key=lambda x: x.dist(target))
@@ -154,24 +224,14 @@ class Creature(SimpleSprite, CascadeElement):
             return None
 
     def move_or_attack(self, destination):
-        if not destination.in_boundaries(self.combat.MAP_RADIUS):
+        if not self.combat.board.contains(destination):
             return
-        if destination in self.combat.creatures and self.is_pc != self.combat.creatures[destination].is_pc:
+        if self.combat.is_enemy_at(self, destination):
             return self.attack(destination)
         elif self.rooted:
             return
-        elif destination in self.combat.creatures:
-            # Swap places
-            other_cr = self.combat.creatures[destination]
-            other_cr.tile = self.tile
-            other_cr.rect.x, other_cr.rect.y = other_cr.tile.display_location()
-            other_cr.combat.creatures[self.tile] = other_cr
-            del self.combat.creatures[destination]
-        else:
-            del self.combat.creatures[self.tile]
-        self.tile = destination
-        self.rect.x, self.rect.y = self.tile.display_location()
-        self.combat.creatures[destination] = self
+        # Swaps places with an ally standing on destination
+        self.combat.move_creature(self, destination)
         if self.free_moves:
             self.free_moves -= 1
         else:
@@ -182,19 +242,32 @@ class Creature(SimpleSprite, CascadeElement):
 
     def end_act(self):
         self.next_action += 100
-        self.free_moves = self.FREE_MOVES
+        self.free_moves = self.max_free_moves
+        self.combat.timeline.schedule(self)
+        if self.hooks:
+            for hook in self.hooks.get('on_end_act', ()):
+                hook(self)
 
     def attack(self, destination):
         creature = self.combat.creatures[destination]
-        creature.take_damage(self.damage)
-        # self.game.dmg_log_display.push_line(self.image_name, 'icons/sword.png', self.damage)
+        if self.combat.events:
+            self.combat.events.emit(Attack(self, creature))
+        creature.take_damage(self.damage, source=self)
         self.end_act()
 
     def use_ability(self, ability, target):
         if self.silenced:
             return
+        if self.combat.events:
+            self.combat.events.emit(Cast(self, ability, target))
         ability.apply_ability(self, target)
-        if not ability.is_instant:
+        if ability.is_instant:
+            return
+        paid = False
+        if self.hooks:
+            for hook in self.hooks.get('on_use_ability', ()):
+                paid = hook(self, ability) or paid
+        if not paid:
             self.end_act()
 
     def add_status(self, status_effect):
@@ -203,13 +276,24 @@ class Creature(SimpleSprite, CascadeElement):
                 status.duration = max(status_effect.duration, status.duration)
                 return
         self.status.append(status_effect)
+        status_effect.attach(self)
         status_effect.status_start(self)
+        if self.combat.events:
+            self.combat.events.emit(StatusApply(self, status_effect))
+        self.combat.add_timer(status_effect, self)
 
-    def take_damage(self, number, dmg_type='physical'):
+    def take_damage(self, number, dmg_type='physical', source=None):
+        """source is the creature attacking, or the ability or status dealing the damage."""
+        raw = number
         if dmg_type == 'physical' and self.armor > 0:
             number = round(10 * number / (10 + self.armor))
         elif dmg_type == 'magic' and self.magic_resist > 0:
             number = round(10 * number / (10 + self.magic_resist))
+        events = self.combat.events if self.combat else None
+        if events:
+            events.emit(Damage(source, self, dmg_type, raw, number))
+            if self.shield > 0:
+                events.emit(ShieldAbsorb(self, min(self.shield, number)))
         if self.shield:
             self.shield -= number
             if self.shield < 0:
@@ -217,48 +301,56 @@ class Creature(SimpleSprite, CascadeElement):
                 self.shield = 0
         else:
             self.health -= number
-        self.frames.extend(['tiles/Hit.png', self.image_name])
         if self.health <= 0:
             for status in self.status:
                 status.status_end(self)
             self.status = []
-            self.passives = []
-            # self.game.log_display.push_text("%s dies." % (self.name))
-            del self.combat.creatures[self.tile]
-            self.must_show = False
+            self.set_passives([])
+            if events:
+                events.emit(Death(self))
+            self.combat.remove_creature(self)
+            self.combat.timeline.remove(self)
+            if self in self.combat.tickers:
+                self.combat.tickers.remove(self)
+
+    def perform(self, action):
+        """Plays an action as listed by Combat.legal_actions."""
+        if action[0] == 'move':
+            self.move_or_attack(action[1])
+        elif action[0] == 'ability':
+            self.use_ability(self.abilities[action[1]], action[2])
+        else:
+            self.idle()
 
     def ai_play(self):
-        nearest_pc = min([c for c in self.combat.creatures.values() if c.is_pc],
-                         key=lambda x: x.tile.dist(self.tile))
+        self.perform(self.ai_action())
+
+    def ai_action(self, rng=None):
+        """The scripted AI decision. Random draws come from rng, by default the AI stream of the combat."""
+        nearest_pc = self.combat.nearest_enemy(self)
+        distance = self.combat.board.distance(self.tile, nearest_pc.tile)
         # FLEEING
-        if self.is_ranged and self.tile.dist(nearest_pc.tile) < 2.25:
+        if self.is_ranged and distance < 2.25:
             tile = self.step_away(nearest_pc.tile)
-            if tile and tile.in_boundaries(self.combat.MAP_RADIUS) and not self.rooted:
-                self.move_or_attack(tile)
-                return
+            if tile and self.combat.board.contains(tile) and not self.rooted:
+                return ('move', tile)
         # CASTING
         if self.abilities and not self.silenced:
-            ability = random.choice(self.abilities)
+            rng = rng or self.combat.rng['ai']
+            ability = rng.choice(self.abilities)
             if ability.current_cooldown == 0:
                 valid_targets = self.combat.get_valid_targets(self, ability)
                 if valid_targets:
-                    target = random.choice(valid_targets)
-                    self.use_ability(ability, target)
-                    return
+                    target = rng.choice(valid_targets)
+                    return ('ability', self.abilities.index(ability), target)
         # HUNTING
-        if (not self.rooted or nearest_pc.tile.dist(self.tile) < 1.25) and (not self.is_ranged or nearest_pc.tile.dist(self.tile) > 3.25):
+        if (not self.rooted or distance < 1.25) and (not self.is_ranged or distance > 3.25):
             tile = self.step_to(nearest_pc.tile)
             # Only swap position with a lesser hp ally to avoid dancing
-            if tile not in self.combat.creatures or self.combat.creatures[tile].is_pc != self.is_pc or self.combat.creatures[tile].health < self.health:
-                self.move_or_attack(tile)
-                return
+            if not self.combat.is_ally_at(self, tile) or self.combat.creatures[tile].health < self.health:
+                return ('move', tile)
         # IDLE
-        self.idle()
-
-    def display(self):
-        if self.combat:
-            CascadeElement.display(self)
-        SimpleSprite.display(self)
+        return ('idle',)
 
 
 DEFS = {
@@ -394,3 +486,5 @@ DEFS = {
         'abilities': [('Scream', {'power': 14, 'ability_range': 2, 'cooldown': 300, 'duration':300 })],
     },
 }
+
+POOL = CreaturePool()
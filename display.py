@@ -4,19 +4,30 @@
 import os, pygame
 import re
 from pygame.locals import *
-from pygame.compat import geterror
 import sys
 import time
-from collections import defaultdict
+import weakref
+from collections import defaultdict, OrderedDict
 
 #custom module containing card database
 
+
+def geterror():
+    return sys.exc_info()[1]
+
  
 if not pygame.font: 
     sys.exit("Fonts unavailable, cannot start. Try installing SDL_ttf")
 if not pygame.mixer: 
     print ('Warning, sound disabled')
 
+SCREEN_SIZE = (960, 600)
+# Share of the screen past which a frame is flipped whole rather than updated by rectangles
+FULL_REDRAW_RATIO = 0.5
+# Marked rectangles past which the next frame is flipped whole, however small they are
+MAX_MARKED = 256
+DIRTY_COLOR = (255, 0, 255)
+
 
 class Display:
     def __init__(self):
@@ -25,6 +36,16 @@ class Display:
         self.mouse_handlers = []
         self.update_handlers = []
         self.sprites = pygame.sprite.OrderedUpdates(())
+        # Dirty rectangles, see present. [F3] outlines them, [F4] flips every frame whole
+        self.show_dirty = False
+        self.full_redraw = False
+        self.blits = set()
+        self.shown = set()
+        # None once so much is marked that the next frame is flipped whole
+        self.marked = []
+        self.marked_area = 0
+        self.full_frames = 0
+        self.partial_frames = 0
 
         #clock = pygame.time.Clock()
 
@@ -48,13 +69,65 @@ class Display:
 
     def setup(self):
         pygame.init()
-        self.screen = pygame.display.set_mode((960, 600)) #, pygame.FULLSCREEN|pygame.HWSURFACE)
+        self.screen = pygame.display.set_mode(SCREEN_SIZE) #, pygame.FULLSCREEN|pygame.HWSURFACE)
         pygame.mouse.set_visible(False)
         pygame.display.set_caption('HexRL')
+        # Images scaled before there was a display are not in its format
+        SURFACES.clear()
         #pygame.mouse.set_visible(0)
         #Display The Background
         pygame.display.flip()
 
+    def blit(self, image, rect):
+        """Draws image on the screen, keeping track of it for present."""
+        area = self.screen.blit(image, rect)
+        # The image itself rather than its id, which a new surface could get once it is freed
+        self.blits.add((image, area.x, area.y, area.w, area.h))
+
+    def mark(self, rect):
+        """Has present update rect, for sprites changing their image or place.
+
+        A rect within one already marked is left out. Past FULL_REDRAW_RATIO of the
+        screen or MAX_MARKED rects, nothing more is kept and the next frame is flipped
+        whole, so that marks do not pile up when no frame is presented."""
+        if self.marked is None:
+            return
+        rect = pygame.Rect(rect)
+        for other in self.marked:
+            if other.contains(rect):
+                return
+        self.marked.append(rect)
+        self.marked_area += rect.w * rect.h
+        if len(self.marked) > MAX_MARKED or self.marked_area > FULL_REDRAW_RATIO * SCREEN_SIZE[0] * SCREEN_SIZE[1]:
+            self.marked = None
+
+    def present(self):
+        """Shows the frame drawn since the last call.
+
+        Only the areas of the blits that were not in the previous frame, those of the
+        blits it had and this one has not, and the marked ones are sent to the window.
+        The whole screen is flipped when they cover most of it, or in full redraw mode."""
+        rects = [pygame.Rect(area[1:]) for area in self.blits ^ self.shown]
+        marked = self.marked
+        self.shown, self.blits, self.marked, self.marked_area = self.blits, set(), [], 0
+        width, height = self.screen.get_size()
+        if marked is not None:
+            rects += marked
+        if self.full_redraw or marked is None or sum(rect.w * rect.h for rect in rects) > FULL_REDRAW_RATIO * width * height:
+            self.full_frames += 1
+            pygame.display.flip()
+            return
+        self.partial_frames += 1
+        if not rects:
+            return
+        if self.show_dirty:
+            for rect in rects:
+                pygame.draw.rect(self.screen, DIRTY_COLOR, rect, 1)
+            # The outlines stay on the screen until drawn over, so the next frame updates them too
+            for rect in rects:
+                self.mark(rect)
+        pygame.display.update(rects)
+
     def handle_key(self, key, unicode):
         for k, handlers in list(self.key_handlers.items()):
             for handler in handlers:
@@ -64,7 +137,7 @@ class Display:
     def main(self):
         pressed_dirs = set()
         while True:
-            pygame.display.flip()
+            self.present()
             # Handle Input Events
             pos = pygame.mouse.get_pos()
             for event in pygame.event.get():
@@ -73,6 +146,10 @@ class Display:
                 elif event.type == KEYDOWN:
                     if event.key in (K_DOWN, K_UP, K_LEFT, K_RIGHT):
                         pressed_dirs.add(event.key)
+                    elif event.key == K_F3:
+                        self.show_dirty = not self.show_dirty
+                    elif event.key == K_F4:
+                        self.full_redraw = not self.full_redraw
                     else:
                         self.handle_key(event.key, event.unicode)
                 elif event.type == KEYUP:
@@ -129,7 +206,6 @@ def load_sound(name):
 #    whiff_sound = load_sound('whiff.wav')
 #    whiff_sound.play()
 
-
 class CascadeElement:
     def __init__(self, subsprites=[]):
         self.subsprites = subsprites
@@ -146,6 +222,15 @@ class SimpleSprite (pygame.sprite.Sprite):
     """ Simple sprites refreshed every frame."""
     #functions to create our resources
     loaded_images = {}
+    views = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def of(model):
+        """Sprite standing for a pygame-free model object (item...), built on first use."""
+        if model not in SimpleSprite.views:
+            SimpleSprite.views[model] = SimpleSprite(model.image_name)
+        return SimpleSprite.views[model]
+
     @staticmethod
     def load_image(name):
         main_dir = os.path.split(os.path.abspath(__file__))[0]
@@ -163,27 +248,74 @@ class SimpleSprite (pygame.sprite.Sprite):
 
     def __init__(self, image_name):
         super(SimpleSprite, self).__init__()
-        self.image = self.load_image(image_name)
-        rect = self.image.get_rect()
-        self.image = pygame.transform.scale(self.image, (rect.w * 2, rect.h * 2)) 
+        self.image = SURFACES.get(image_name)
         self.rect = self.image.get_rect()
         self.frame_name = image_name
         self.must_show = True
 
     def move_to(self, x, y):
+        if (x, y) == self.rect.topleft:
+            return
+        DISPLAY.mark(self.rect)
         self.rect.x, self.rect.y = x, y
+        DISPLAY.mark(self.rect)
 
     def display(self):
         if self.must_show:
-            DISPLAY.screen.blit(self.image, self.rect)
+            DISPLAY.blit(self.image, self.rect)
     
     def animate(self, frame_name):
         if frame_name == self.frame_name:
             return
-        self.image = SimpleSprite.load_image(frame_name)
-        rect = self.image.get_rect()
-        self.image = pygame.transform.scale(self.image, (rect.w * 2, rect.h * 2)) 
+        self.image = SURFACES.get(frame_name)
         self.frame_name = frame_name
+        DISPLAY.mark(self.rect)
+
+
+class SurfaceCache:
+    """Images scaled and converted to the display format, by (name, scale, alpha), for SimpleSprite.
+
+    Surfaces are shared by every sprite showing them, so they must not be drawn on.
+    Past budget bytes, the least recently used ones are dropped."""
+    def __init__(self, budget=32 << 20):
+        self.budget = budget
+        self.surfaces = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name, scale=2, alpha=None):
+        """alpha: convert_alpha if True, convert if False, by whether the file has per pixel alpha if None."""
+        image = SimpleSprite.load_image(name)
+        if alpha is None:
+            alpha = bool(image.get_flags() & SRCALPHA)
+        key = (name, scale, alpha)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        w, h = image.get_size()
+        surface = pygame.transform.scale(image, (w * scale, h * scale))
+        # Without a display there is no format to convert to, as in tests
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha() if alpha else surface.convert()
+        self.surfaces[key] = surface
+        self.size += surface.get_pitch() * surface.get_height()
+        while self.size > self.budget and len(self.surfaces) > 1:
+            _, dropped = self.surfaces.popitem(last=False)
+            self.size -= dropped.get_pitch() * dropped.get_height()
+            self.evictions += 1
+        return surface
+
+    def clear(self):
+        self.surfaces = OrderedDict()
+        self.size = 0
+
+
+SURFACES = SurfaceCache()
 
 
 class Gauge(pygame.sprite.Sprite):
@@ -199,21 +331,37 @@ class Gauge(pygame.sprite.Sprite):
         self.must_show = True
 
     def move_to(self, x, y):
+        if (x, y) == self.rect.topleft:
+            return
+        self.mark()
         self.rect.x, self.rect.y = x, y
+        self.mark()
+
+    def mark(self):
+        """Marks the area the gauge covers, which is not its rect once resized."""
+        DISPLAY.mark((self.rect.topleft, self.image.get_size()))
 
     def display(self):
         if self.must_show:
-            DISPLAY.screen.blit(self.image, self.rect)
+            DISPLAY.blit(self.image, self.rect)
 
     def set_width (self, size):
+        if (size, self.height) == self.image.get_size():
+            return
+        self.mark()
         self.image = pygame.Surface((size, self.height))
         self.image.fill(pygame.Color(self.color))
         self.width = size
+        self.mark()
 
     def set_height (self, size):
+        if (self.width, size) == self.image.get_size():
+            return
+        self.mark()
         self.image = pygame.Surface((self.width, size))
         self.image.fill(pygame.Color(self.color))
         self.height = size
+        self.mark()
 
 
 class TextSprite:
@@ -226,6 +374,7 @@ class TextSprite:
         self.y = y
         self.textsprites = []
         self.must_show = True
+        self.text = text
         self._render(text)
 
     def _render(self, text):
@@ -245,15 +394,21 @@ class TextSprite:
                 j += 16
 
     def set_text (self, text):
-        if self.textsprites:
-            self.textsprites = []
+        if text == self.text:
+            return
+        for sprite in self.textsprites:
+            DISPLAY.mark((sprite.rect.topleft, sprite.image.get_size()))
+        self.textsprites = []
+        self.text = text
         self._render(text)
+        for sprite in self.textsprites:
+            DISPLAY.mark((sprite.rect.topleft, sprite.image.get_size()))
 
     def display(self):
         if not self.must_show:
             return
         for sprite in self.textsprites:
-            DISPLAY.screen.blit(sprite.image, sprite.rect)
+            DISPLAY.blit(sprite.image, sprite.rect)
 
 
 class Interface:
@@ -0,0 +1,109 @@
+import numpy as np
+from board import Board
+from events import TurnStart, Move, Swap, Cast, Damage, Death, Summon, StatusApply, StatusExpire
+
+PLANES = ('on_board', 'occupied', 'ally', 'enemy', 'health', 'shield', 'armor', 'magic_resist',
+          'rooted', 'silenced', 'ready_1', 'ready_2', 'ready_3', 'time_to_act', 'to_act')
+ON_BOARD = 0
+# First of the planes read from the combat clock, which all change at every turn
+CLOCK = PLANES.index('ready_1')
+ABILITY_SLOTS = 3
+
+
+class Encoder:
+    """Writes a combat as feature planes on the offset grid of GameTile.all_tiles, in place.
+
+    Tile (x, y) is at column x + bound and row y - (x % 2) / 2 + bound, bound
+    being int(radius + 1) as in all_tiles. Features are seen from side is_pc.
+
+    The encoder follows the events of the combat it last encoded, and only
+    writes again the tiles they touched, and the clock planes of every creature
+    after a TurnStart. A combat rewound, or another one, is encoded in full."""
+    def __init__(self, radius, is_pc=True, out=None):
+        self.board = Board.of_radius(radius)
+        self.is_pc = is_pc
+        bound = int(radius + 1)
+        self.shape = (len(PLANES), 2 * bound + 1, 2 * bound + 1)
+        self.array = np.zeros(self.shape, np.float32) if out is None else out
+        self.rows = [round(tile.y - (tile.x % 2) / 2) + bound for tile in self.board.tiles]
+        self.columns = [tile.x + bound for tile in self.board.tiles]
+        self.combat = None
+        self.reset()
+
+    def reset(self):
+        """Clears the array, for a new combat."""
+        self.array[:] = 0
+        self.array[ON_BOARD, self.rows, self.columns] = 1
+        self.detach()
+
+    def attach(self, combat):
+        """Follows the events of combat, everything being dirty until the next encode."""
+        self.detach()
+        self.combat = combat
+        self.history_length = len(combat.history)
+        self.dirty = set(range(len(self.board)))
+        self.clock = True
+        self.to_act = None
+        combat.events.subscribe(self.on_event, TurnStart, Move, Swap, Cast, Damage, Death, Summon,
+                                StatusApply, StatusExpire)
+
+    def detach(self):
+        if self.combat is not None:
+            self.combat.events.unsubscribe(self.on_event)
+            self.combat = None
+
+    def on_event(self, event):
+        index = self.board.index
+        kind = type(event)
+        if kind is Move or kind is Swap:
+            self.dirty.update((index[event.source], index[event.destination]))
+        elif kind is Damage or kind is StatusApply or kind is StatusExpire:
+            self.dirty.add(index[event.target.tile])
+        elif kind is Death:
+            self.dirty.add(index[event.creature.tile])
+        elif kind is Summon:
+            self.dirty.add(index[event.tile])
+        elif kind is Cast:
+            # Cooldown and health cost of the caster, shield of the target
+            self.dirty.update((index[event.creature.tile], index[event.target]))
+        else:
+            # The clock moved, and on_tick passives with it
+            self.clock = True
+            self.dirty.update(index[creature.tile] for creature in self.combat.tickers)
+
+    def features(self, creature, combat):
+        ally = creature.is_pc == self.is_pc
+        return (1, ally, not ally, creature.health / creature.maxhealth, creature.shield / creature.maxhealth,
+                creature.armor / 10, creature.magic_resist / 10, bool(creature.rooted), bool(creature.silenced),
+                *self.clock_features(creature, combat))
+
+    def clock_features(self, creature, combat):
+        ready = [1 - ability.current_cooldown / ability.cooldown if ability.cooldown else 1
+                 for ability in creature.abilities[:ABILITY_SLOTS]]
+        ready += [0] * (ABILITY_SLOTS - len(ready))
+        return (*ready, (creature.next_action - combat.turn) / 100, creature is combat.to_act)
+
+    def encode(self, combat):
+        if combat is not self.combat or len(combat.history) < self.history_length:
+            self.attach(combat)
+        self.history_length = len(combat.history)
+        creatures = combat.creatures
+        tiles = self.board.tiles
+        # end_act changes the creature that acted without an event, even when it acts again
+        for creature in (self.to_act, combat.to_act):
+            if creature is not None and creatures.get(creature.tile) is creature:
+                self.dirty.add(self.board.index[creature.tile])
+        self.to_act = combat.to_act
+        for i in self.dirty:
+            creature = creatures.get(tiles[i])
+            if creature is None:
+                self.array[ON_BOARD + 1:, self.rows[i], self.columns[i]] = 0
+            else:
+                self.array[ON_BOARD + 1:, self.rows[i], self.columns[i]] = self.features(creature, combat)
+        if self.clock:
+            for tile, creature in creatures.items():
+                i = self.board.index[tile]
+                self.array[CLOCK:, self.rows[i], self.columns[i]] = self.clock_features(creature, combat)
+        self.dirty = set()
+        self.clock = False
+        return self.array
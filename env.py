@@ -0,0 +1,208 @@
+"""Reinforcement learning environments over combat.Combat, in the reset / step style of gym.
+
+The agent plays every creature of one side, the scripted AI the other. Actions
+are integers: 0-5 move or attack towards tile.neighbours()[action], 6 idles,
+and 7 + slot * board size + tile index uses ability slot on that board tile.
+Observations are the feature planes of encoder.Encoder. They are written in
+place, so they are overwritten by the next step: copy them to keep them.
+"""
+from combat import Combat, FORMATION
+from board import Board
+from encoder import Encoder, ABILITY_SLOTS
+from simulate import make_party, parse_party
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+IDLE = 6
+FIRST_ABILITY = 7
+
+
+class CombatEnv:
+    def __init__(self, party='Fighter,Barbarian,Archer,Wizard,Enchantress', mobs=('Skeleton',) * 6,
+                 is_pc=True, max_actions=3000, combat_class=Combat, out=None):
+        self.party = parse_party(party) if isinstance(party, str) else party
+        self.mobs = list(mobs)
+        self.is_pc = is_pc
+        self.max_actions = max_actions
+        self.combat_class = combat_class
+        self.board = Board.of_radius(combat_class.MAP_RADIUS)
+        self.action_count = FIRST_ABILITY + ABILITY_SLOTS * len(self.board)
+        self.encoder = Encoder(combat_class.MAP_RADIUS, is_pc, out)
+        self.combat = None
+        self.actions = 0
+
+    def reset(self, seed=None):
+        if self.combat:
+            self.combat.release()
+        self.combat = self.combat_class(zip(make_party(self.party), FORMATION), self.mobs, seed)
+        self.combat.new_turn()
+        self.actions = 0
+        self.encoder.reset()
+        self.play_opponents()
+        return self.observe(), self.info()
+
+    def step(self, action):
+        """Plays action for the agent's creature to act, then the opponents until the agent's next turn.
+
+        Reward is 1 for a won fight, -1 for a lost one and 0 otherwise."""
+        self.combat.play(self.decode(action))
+        self.actions += 1
+        self.play_opponents()
+        terminated = self.combat.is_over()
+        reward = 0
+        if terminated:
+            reward = 1 if self.combat.side_mask(self.is_pc) else -1
+        truncated = not terminated and self.actions >= self.max_actions
+        return self.observe(), reward, terminated, truncated, self.info()
+
+    def play_opponents(self):
+        while not self.combat.is_over() and self.combat.to_act.is_pc != self.is_pc and self.actions < self.max_actions:
+            self.combat.play(self.combat.ai_action())
+            self.actions += 1
+
+    def decode(self, action):
+        creature = self.combat.to_act
+        if action < IDLE:
+            return ('move', creature.tile.neighbours()[action])
+        if action == IDLE:
+            return ('idle',)
+        slot, index = divmod(action - FIRST_ABILITY, len(self.board))
+        return ('ability', slot, self.board.tiles[index])
+
+    def encode(self, action):
+        if action[0] == 'move':
+            return self.combat.to_act.tile.neighbours().index(action[1])
+        if action[0] == 'idle':
+            return IDLE
+        return FIRST_ABILITY + action[1] * len(self.board) + self.board.index[action[2]]
+
+    def action_mask(self):
+        """One bool per action, True for the actions that do something, from Combat.legal_actions."""
+        mask = [False] * self.action_count
+        if not self.combat.is_over():
+            for action in self.combat.legal_actions():
+                if action[0] != 'ability' or action[1] < ABILITY_SLOTS:
+                    mask[self.encode(action)] = True
+        return mask
+
+    def observe(self):
+        return self.encoder.encode(self.combat)
+
+    def info(self):
+        return {'action_mask': self.action_mask(), 'turn': self.combat.turn}
+
+
+class VectorEnv:
+    """Steps several environments in one call, resetting each one when its fight ends.
+
+    Observations are returned as one array, env by env, that the environments write into.
+    The observation and info that ended a fight are in info['final_observation'] and info['final_info'].
+    Environment i plays seeds seed + i, then seed + i + stride and so on, stride being count by default."""
+    def __init__(self, count, stride=None, out=None, **kwargs):
+        if out is None:
+            out = np.zeros((count,) + observation_shape(kwargs.get('combat_class', Combat)), np.float32)
+        self.observations = out
+        self.envs = [CombatEnv(out=out[i], **kwargs) for i in range(count)]
+        self.seeds = [None] * count
+        self.stride = stride or count
+
+    def reset(self, seed=None):
+        results = []
+        for i, env in enumerate(self.envs):
+            self.seeds[i] = None if seed is None else seed + i
+            results.append(env.reset(self.seeds[i]))
+        return self.observations, [info for _, info in results]
+
+    def step(self, actions):
+        results = [self._step(i, env, action) for i, (env, action) in enumerate(zip(self.envs, actions))]
+        rewards, terminated, truncated, infos = (list(column) for column in zip(*results))
+        return self.observations, rewards, terminated, truncated, infos
+
+    def _step(self, i, env, action):
+        obs, reward, terminated, truncated, info = env.step(action)
+        if terminated or truncated:
+            if self.seeds[i] is not None:
+                self.seeds[i] += self.stride
+            final = {'final_observation': obs.copy(), 'final_info': info}
+            _, info = env.reset(self.seeds[i])
+            info.update(final)
+        return reward, terminated, truncated, info
+
+    def close(self):
+        pass
+
+
+def observation_shape(combat_class=Combat):
+    return Encoder(combat_class.MAP_RADIUS).shape
+
+
+def _worker(connection, memory_name, shape, first, count, stride, kwargs):
+    memory = SharedMemory(memory_name)
+    observations = np.ndarray(shape, np.float32, memory.buf)
+    vector = VectorEnv(count, stride, observations[first:first + count], **kwargs)
+    while True:
+        command, data = connection.recv()
+        if command == 'reset':
+            connection.send(vector.reset(data)[1:])
+        elif command == 'step':
+            connection.send(vector.step(data)[1:])
+        else:
+            del observations, vector
+            memory.close()
+            connection.close()
+            return
+
+
+class SubprocVectorEnv:
+    """VectorEnv spread over worker processes, each stepping its share of the environments.
+
+    Workers write observations straight into shared memory, only rewards and infos go through pipes."""
+    def __init__(self, count, workers, **kwargs):
+        shares = [count // workers + (i < count % workers) for i in range(workers)]
+        self.shares = [share for share in shares if share]
+        shape = (count,) + observation_shape(kwargs.get('combat_class', Combat))
+        self.memory = SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self.observations = np.ndarray(shape, np.float32, self.memory.buf)
+        self.connections = []
+        self.processes = []
+        first = 0
+        for share in self.shares:
+            parent, child = Pipe()
+            process = Process(target=_worker, args=(child, self.memory.name, shape, first, share, count, kwargs),
+                              daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+            first += share
+
+    def reset(self, seed=None):
+        first = 0
+        for connection, share in zip(self.connections, self.shares):
+            connection.send(('reset', None if seed is None else seed + first))
+            first += share
+        return (self.observations,) + self._gather(1)
+
+    def step(self, actions):
+        first = 0
+        for connection, share in zip(self.connections, self.shares):
+            connection.send(('step', actions[first:first + share]))
+            first += share
+        return (self.observations,) + self._gather(4)
+
+    def _gather(self, fields):
+        columns = [[] for _ in range(fields)]
+        for connection in self.connections:
+            for column, part in zip(columns, connection.recv()):
+                column += part
+        return tuple(columns)
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('close', None))
+        for process in self.processes:
+            process.join()
+        del self.observations
+        self.memory.close()
+        self.memory.unlink()
@@ -0,0 +1,53 @@
+"""Typed events emitted by a combat as it is played, for logs, telemetry and replays."""
+from collections import namedtuple
+from contextlib import contextmanager
+
+TurnStart = namedtuple('TurnStart', 'creature turn')
+Move = namedtuple('Move', 'creature source destination')
+# creature moved to destination, other to source
+Swap = namedtuple('Swap', 'creature other source destination')
+Attack = namedtuple('Attack', 'creature target')
+Cast = namedtuple('Cast', 'creature ability target')
+# raw before armor or magic resist, amount after, shield absorbs included
+Damage = namedtuple('Damage', 'source target damage_type raw amount')
+ShieldAbsorb = namedtuple('ShieldAbsorb', 'target amount')
+StatusApply = namedtuple('StatusApply', 'target status')
+StatusExpire = namedtuple('StatusExpire', 'target status')
+Death = namedtuple('Death', 'creature')
+Summon = namedtuple('Summon', 'creature summoner tile')
+
+
+class EventBus:
+    """Subscribers of a single combat, called with every event emitted, in subscription order.
+
+    The bus is falsy without subscribers, so that emitting sites build no event
+    when nobody listens:
+        if self.combat.events:
+            self.combat.events.emit(Death(self))
+    """
+    def __init__(self):
+        self.subscribers = []
+
+    def __bool__(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, callback, *kinds):
+        """Calls callback with the events of the given classes, all of them if none is given."""
+        self.subscribers.append((callback, kinds or None))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [(c, kinds) for c, kinds in self.subscribers if c != callback]
+
+    def emit(self, event):
+        for callback, kinds in self.subscribers:
+            if kinds is None or type(event) in kinds:
+                callback(event)
+
+    @contextmanager
+    def muted(self):
+        """Emits nothing within the block, for plays that are not part of the fight, such as searches."""
+        subscribers, self.subscribers = self.subscribers, []
+        try:
+            yield
+        finally:
+            self.subscribers = subscribers
@@ -1,39 +1,79 @@
 from math import cos, pi, sqrt
 
 
+def _pair(q, r):
+    """Bijection from integer pairs to naturals (zigzag then Szudzik), so hashes never collide."""
+    a = 2 * q if q >= 0 else -2 * q - 1
+    b = 2 * r if r >= 0 else -2 * r - 1
+    return a * a + a + b if a >= b else a + b * b
+
+
 class GameTile:
-    CO = cos(pi / 6)
+    """A hex tile, stored as integer axial coordinates (q, r).
 
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self._x = self.x * self.CO
+    x and y are the display coordinates used everywhere else (columns, and rows
+    shifted by half a step on odd columns): x = q and y = r + q / 2.
+    Tiles are interned: GameTile(x, y) always returns the same instance for the
+    same hex, so neighbours and all_tiles hand out shared objects."""
+    __slots__ = ('q', 'r', 'x', 'y', '_x', '_norm', '_hash', '_neighbours', '__weakref__')
+    CO = cos(pi / 6)
+    _interned = {}
+    _all_tiles = {}
+
+    def __new__(cls, x, y):
+        q = round(x)
+        return cls.axial(q, (round(2 * y) - q) // 2)
+
+    @classmethod
+    def axial(cls, q, r):
+        tile = cls._interned.get((q, r))
+        if tile is None:
+            tile = object.__new__(cls)
+            tile.q = q
+            tile.r = r
+            tile.x = q
+            tile.y = r + q // 2 if q % 2 == 0 else r + q / 2
+            tile._x = tile.x * cls.CO
+            tile._norm = sqrt(tile._x ** 2 + tile.y ** 2)
+            tile._hash = _pair(q, r)
+            tile._neighbours = None
+            cls._interned[(q, r)] = tile
+        return tile
+
+    def __reduce__(self):
+        return GameTile.axial, (self.q, self.r)
 
     def dist(self, other):
+        """Euclidean distance between tile centers, adjacent tiles being 1 apart."""
         return sqrt((self._x - other._x) ** 2 + (self.y - other.y) ** 2)
 
+    def hex_dist(self, other):
+        """Number of steps between the two tiles."""
+        dq, dr = self.q - other.q, self.r - other.r
+        return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
     def neighbours(self):
-        return [
-            self + GameTile(-1, 0.5),
-            self + GameTile(0, 1),
-            self + GameTile(1, 0.5),
-            self + GameTile(-1, -0.5),
-            self + GameTile(0, -1),
-            self + GameTile(1, -0.5),
-        ]
+        if self._neighbours is None:
+            q, r = self.q, self.r
+            self._neighbours = (
+                GameTile.axial(q - 1, r + 1),
+                GameTile.axial(q, r + 1),
+                GameTile.axial(q + 1, r),
+                GameTile.axial(q - 1, r),
+                GameTile.axial(q, r - 1),
+                GameTile.axial(q + 1, r - 1),
+            )
+        return self._neighbours
 
     def in_boundaries(self, radius):
-        return self.dist(GameTile(0, 0)) < radius
+        return self._norm < radius
 
     def __add__(self, other):
         """Tiles are vectors and can as well express steps, can be added etc."""
-        return GameTile(self.x + other.x, self.y + other.y)
+        return GameTile.axial(self.q + other.q, self.r + other.r)
 
     def __sub__(self, other):
-        return GameTile(self.x - other.x, self.y - other.y)
-
-    def __eq__(self, other):
-        return self.__hash__() == other.__hash__()
+        return GameTile.axial(self.q - other.q, self.r - other.r)
 
     def __str__(self):
         return "<%s %s>" % (self.x, self.y)
@@ -42,14 +82,13 @@ class GameTile:
         return "<%s %s>" % (self.x, self.y)
 
     def __hash__(self):
-        return round(2 * self.x) + 100 * round(2 * self.y)
+        return self._hash
 
     def _dist_to_axis(self, d0, dx, dy, c):
         return abs(self._x * dy - self.y * dx + c) / (d0 or 1)
 
     def raycast(self, other, go_through=False, valid_steps=None):
         """Used for los checks mostly"""
-        CO = cos(pi / 6)
         d0 = self.dist(other)
         current_tile = self
         dx, dy = other._x - self._x, other.y - self.y
@@ -93,8 +132,14 @@ class GameTile:
 
     @staticmethod
     def all_tiles(radius):
-        for i in range(-int(radius + 1), int(radius+ 1)):
-            for j in range(-int(radius + 1), int(radius+ 1)):
-                tile = GameTile(i, j + (i % 2)/2)
-                if tile.in_boundaries(radius):
-                    yield tile
+        """Every tile within radius of the center, computed once per radius."""
+        if radius not in GameTile._all_tiles:
+            tiles = []
+            bound = int(radius + 1)
+            for i in range(-bound, bound + 1):
+                for j in range(-bound, bound + 1):
+                    tile = GameTile(i, j + (i % 2) / 2)
+                    if tile.in_boundaries(radius):
+                        tiles.append(tile)
+            GameTile._all_tiles[radius] = tuple(tiles)
+        return GameTile._all_tiles[radius]
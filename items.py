@@ -1,10 +1,8 @@
-from display import SimpleSprite
 from abilities import ABILITIES
 
 
-class Item(SimpleSprite):
+class Item:
     def __init__ (self, name, image_name, shop_price):
-        super().__init__(image_name)
         self.name = name
         self.image_name = image_name
         self.shop_price = shop_price
@@ -24,9 +22,8 @@ class Item(SimpleSprite):
         self.equipped_to = None
 
 
-class Consumable(SimpleSprite):
+class Consumable:
     def __init__(self, name, image_name, shop_price):
-        super().__init__(image_name)
         self.name = name
         self.image_name = image_name
         self.shop_price = shop_price
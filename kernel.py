@@ -0,0 +1,409 @@
+"""Many fights played in lockstep as NumPy arrays, one row per fight and one column per roster slot.
+
+    python kernel.py --party Fighter,Barbarian,Archer,Wizard --mobs Skeleton*6,SkeletonArcher*2 --seeds 0:10000
+
+The kernel knows melee attacks, DamageAbility, AoeAbility and NovaAbility, and
+the Regeneration, Shield, Fastcast, Quick and PartyHeal passives; both sides
+play the scripted AI of Creature.ai_action. Fights are loaded from Combat
+objects, and play exactly as the objects would, random draws included.
+"""
+from abilities import DamageAbility, AoeAbility, NovaAbility
+from passives import RegenerationPassive, ShieldPassive, Fastcast, Quick, HealPassive
+from combat import Combat, FORMATION
+import numpy as np
+import argparse
+import random
+import time
+
+MAX_ACTIONS = 3000
+DAMAGE, AOE, NOVA = 1, 2, 3
+ABILITY_KINDS = {DamageAbility: DAMAGE, AoeAbility: AOE, NovaAbility: NOVA}
+PHYSICAL, MAGIC, TRUE = 0, 1, 2
+DAMAGE_TYPES = {'physical': PHYSICAL, 'magic': MAGIC, 'true': TRUE}
+# PartyHeal only acts once the fight is over
+PASSIVE_KINDS = (RegenerationPassive, ShieldPassive, Fastcast, Quick, HealPassive)
+IDLE, MOVE, ABILITY = 0, 1, 2
+# Tables computed once per board
+_tables = {}
+
+
+class Kernel:
+    """Struct of arrays over fights loaded from combats, which are left untouched.
+
+    Creature stats are (fights, slots) arrays, slots following Combat.roster,
+    and abilities (fights, slots, ability slots) arrays. at[fight, tile] is the
+    slot standing on the tile, -1 if none, with an extra always empty column
+    standing for the tiles off the board. order[fight, slot] follows the order
+    of Combat.creatures, which breaks the ties between nearest enemies."""
+    def __init__(self, combats):
+        self.board = combats[0].board
+        size = self.size = len(self.board)
+        fights = len(combats)
+        slots = max(len(combat.roster) for combat in combats)
+        ability_slots = max([len(c.abilities) for combat in combats for c in combat.roster] + [1])
+        shape = (fights, slots)
+        for name in ('health', 'maxhealth', 'shield', 'damage', 'armor', 'magic_resist', 'tile', 'next_action',
+                     'free_moves', 'moves', 'shield_passive', 'regen_rate', 'regen_cap', 'ability_count', 'order'):
+            setattr(self, name, np.zeros(shape, np.int64))
+        for name in ('alive', 'is_pc', 'ranged', 'fastcast'):
+            setattr(self, name, np.zeros(shape, bool))
+        self.tile[:] = -1
+        shape += (ability_slots,)
+        for name in ('ability_kind', 'power', 'damage_type', 'health_cost', 'cooldown', 'splash', 'ready_at'):
+            setattr(self, name, np.zeros(shape, np.int64))
+        self.reach = np.zeros(shape)
+        self.need_los = np.zeros(shape, bool)
+        self.at = np.full((fights, size + 1), -1)
+        self.turn = np.zeros(fights, np.int64)
+        self.to_act = np.zeros(fights, np.int64)
+        self.actions = np.zeros(fights, np.int64)
+        self.over = np.zeros(fights, bool)
+        self.next_order = np.zeros(fights, np.int64)
+        self.rngs = []
+        self.neighbours = np.array(self.board.neighbours)
+        self.neighbours[self.neighbours < 0] = size
+        self.dist = np.array(self.board.dist)
+        if self.board not in _tables:
+            # Distances from the k-th neighbour of every tile, on the board or not, to every tile,
+            # as step_to and step_away compare them, and lines filled as needed
+            tiles = self.board.tiles
+            _tables[self.board] = (np.array([[[n.dist(t) for t in tiles] for n in tile.neighbours()] for tile in tiles]),
+                                   np.zeros((size, size, size), bool), np.zeros(size, bool))
+        self.neighbour_dist, self.lines, self.lines_built = _tables[self.board]
+        for fight, combat in enumerate(combats):
+            self.load(fight, combat)
+
+    def load(self, fight, combat):
+        if combat.board is not self.board:
+            raise ValueError('fights must be on the same board')
+        index = self.board.index
+        for slot, creature in enumerate(combat.roster):
+            check(creature)
+            at = fight, slot
+            self.alive[at] = creature.tile is not None and combat.creatures.get(creature.tile) is creature
+            for name in ('health', 'maxhealth', 'shield', 'damage', 'armor', 'magic_resist', 'next_action',
+                         'free_moves', 'is_pc', 'ranged'):
+                getattr(self, name)[at] = getattr(creature, 'is_ranged' if name == 'ranged' else name)
+            self.tile[at] = index[creature.tile] if creature.tile is not None else -1
+            self.moves[at] = creature.max_free_moves
+            for passive in creature.passives:
+                if isinstance(passive, RegenerationPassive):
+                    self.regen_rate[at] = passive.rate
+                    self.regen_cap[at] = passive.maxhealth or creature.maxhealth
+                elif isinstance(passive, ShieldPassive):
+                    self.shield_passive[at] = max(self.shield_passive[at], passive.shield)
+                elif isinstance(passive, Fastcast):
+                    self.fastcast[at] = True
+            self.ability_count[at] = len(creature.abilities)
+            for k, ability in enumerate(creature.abilities):
+                ability_at = at + (k,)
+                self.ability_kind[ability_at] = ABILITY_KINDS[type(ability)]
+                self.power[ability_at] = ability.power
+                self.reach[ability_at] = ability.ability_range + 0.25
+                self.need_los[ability_at] = ability.need_los
+                self.damage_type[ability_at] = DAMAGE_TYPES[ability.damage_type]
+                self.health_cost[ability_at] = ability.health_cost
+                self.cooldown[ability_at] = ability.cooldown
+                self.splash[ability_at] = round(ability.power * ability.aoe)
+                self.ready_at[ability_at] = combat.turn + ability.current_cooldown
+            if self.alive[at]:
+                self.at[fight, self.tile[at]] = slot
+        for order, creature in enumerate(combat.creatures.values()):
+            self.order[fight, combat.roster.index(creature)] = order
+        self.next_order[fight] = len(combat.creatures)
+        self.turn[fight] = combat.turn
+        self.to_act[fight] = combat.roster.index(combat.to_act) if combat.to_act else -1
+        self.over[fight] = combat.is_over()
+        # A copy, so that the combat can still be played on its own
+        rng = random.Random()
+        rng.setstate(combat.rng['ai'].getstate())
+        self.rngs.append(rng)
+
+    def run(self, max_actions=MAX_ACTIONS):
+        """Steps until every fight is over or has played max_actions actions."""
+        while self.step(max_actions):
+            pass
+
+    def step(self, max_actions=MAX_ACTIONS):
+        """Plays the AI action of the creature to act in every fight going on, as Combat.play does.
+
+        Returns the number of fights that played."""
+        rows = np.flatnonzero(~self.over & (self.actions < max_actions))
+        if not len(rows):
+            return 0
+        size = self.size
+        actor = self.to_act[rows]
+        here = self.tile[rows, actor]
+        health = self.health[rows, actor]
+        ranged = self.ranged[rows, actor]
+        occupant = self.at[rows]
+        taken = occupant >= 0
+        on_tile = np.maximum(occupant, 0)
+        enemy = taken & (self.is_pc[rows[:, None], on_tile] != self.is_pc[rows, actor][:, None])
+        ally = taken & ~enemy
+        occupant_health = self.health[rows[:, None], on_tile]
+        # The nearest enemy, the first one in Combat.creatures on ties
+        foe = self.alive[rows] & (self.is_pc[rows] != self.is_pc[rows, actor][:, None])
+        distance = np.where(foe, self.dist[here[:, None], np.maximum(self.tile[rows], 0)], np.inf)
+        near = distance.min(1)
+        first = np.where(distance == near[:, None], self.order[rows], np.iinfo(np.int64).max).argmin(1)
+        nearest = self.tile[rows, first]
+        neighbours = self.neighbours[here]
+        nearest_dist = self.neighbour_dist[here, :, nearest]
+
+        kind = np.full(len(rows), IDLE)
+        destination = np.full(len(rows), -1)
+        chosen = np.zeros(len(rows), np.int64)
+        target = np.full(len(rows), -1)
+
+        # Fleeing, to the free neighbour farthest from the nearest enemy, unless it is off the board
+        flee = np.flatnonzero(ranged & (near < 2.25))
+        free = ~taken[flee[:, None], neighbours[flee]]
+        step = neighbours[flee, np.where(free, nearest_dist[flee], -np.inf).argmax(1)]
+        fled = free.any(1) & (step < size)
+        kind[flee[fled]] = MOVE
+        destination[flee[fled]] = step[fled]
+
+        # Casting
+        count = self.ability_count[rows, actor]
+        cast = np.flatnonzero((kind == IDLE) & (count > 0))
+        for i in cast:
+            chosen[i] = self.rngs[rows[i]].choice(range(count[i]))
+        ability = rows[cast], actor[cast], chosen[cast]
+        cast = cast[self.ready_at[ability] <= self.turn[rows[cast]]]
+        ability = rows[cast], actor[cast], chosen[cast]
+        valid = enemy[cast, :size] & (self.dist[here[cast]] <= self.reach[ability][:, None])
+        pair, tile = np.nonzero(valid & self.need_los[ability][:, None])
+        self.build_lines(here[cast[pair]])
+        blocked = (self.lines[here[cast[pair]], tile] & enemy[cast[pair], :size]).any(1)
+        valid[pair[blocked], tile[blocked]] = False
+        nova = np.flatnonzero(self.ability_kind[ability] == NOVA)
+        valid[nova] = False
+        valid[nova, here[cast[nova]]] = True
+        count = valid.sum(1)
+        draw = np.zeros(len(cast), np.int64)
+        for k in np.flatnonzero(count):
+            draw[k] = self.rngs[rows[cast[k]]].choice(range(count[k]))
+        # The tile of the draw-th valid target, in board order
+        drawn = (valid.cumsum(1) > draw[:, None]).argmax(1)
+        kind[cast[count > 0]] = ABILITY
+        target[cast[count > 0]] = drawn[count > 0]
+
+        # Hunting, to the neighbour closest to the nearest enemy, which does nothing when off the board
+        hunt = np.flatnonzero((kind == IDLE) & (~ranged | (near > 3.25)))
+        step = neighbours[hunt, nearest_dist[hunt].argmin(1)]
+        # Only swaps places with a lesser hp ally to avoid dancing
+        hunt_ok = ~(ally[hunt, step] & (occupant_health[hunt, step] >= health[hunt]))
+        kind[hunt[hunt_ok]] = MOVE
+        destination[hunt[hunt_ok]] = step[hunt_ok]
+
+        self.perform(rows, actor, here, kind, destination, chosen, target, enemy)
+        self.actions[rows] += 1
+        self.new_turn(rows)
+        return len(rows)
+
+    def perform(self, rows, actor, here, kind, destination, chosen, target, enemy):
+        """Creature.perform for a batch, every creature hit in a fight being hit once."""
+        size = self.size
+        ends = [np.flatnonzero(kind == IDLE)]
+        hits = []
+
+        # A move off the board does nothing, and the act goes on
+        moving = np.flatnonzero((kind == MOVE) & (destination < size))
+        attack = moving[enemy[moving, destination[moving]]]
+        fights = rows[attack]
+        hits.append((fights, self.at[fights, destination[attack]], self.damage[fights, actor[attack]],
+                     np.full(len(attack), PHYSICAL)))
+        ends.append(attack)
+        move = moving[~enemy[moving, destination[moving]]]
+        fights, slots, source, tile = rows[move], actor[move], here[move], destination[move]
+        # Swaps places with an ally standing on destination
+        other = self.at[fights, tile]
+        swap = other >= 0
+        self.tile[fights[swap], other[swap]] = source[swap]
+        self.at[fights, source] = other
+        self.at[fights, tile] = slots
+        self.tile[fights, slots] = tile
+        # Combat.move_creature puts the mover last in Combat.creatures, and the ally it swaps with in its place
+        self.order[fights[swap], other[swap]] = self.order[fights[swap], slots[swap]]
+        self.order[fights, slots] = self.next_order[fights]
+        self.next_order[fights] += 1
+        ends.append(self.spend_move(move, rows, actor))
+
+        cast = np.flatnonzero(kind == ABILITY)
+        fights, slots, ability = rows[cast], actor[cast], chosen[cast]
+        at = fights, slots, ability
+        self.ready_at[at] = self.turn[fights] + self.cooldown[at]
+        ability_kind = self.ability_kind[at]
+        bolt = ability_kind != NOVA
+        caster = fights[bolt], slots[bolt]
+        self.health[caster] -= self.health_cost[at][bolt]
+        self.health[caster] = np.maximum(self.health[caster], 1)
+        hits.append((fights[bolt], self.at[fights[bolt], target[cast[bolt]]], self.power[at][bolt],
+                     self.damage_type[at][bolt]))
+        aoe = np.flatnonzero(ability_kind == AOE)
+        splashed = self.neighbours[target[cast[aoe]]]
+        splashed_enemy = enemy[cast[aoe, None], splashed]
+        hit, k = np.nonzero(splashed_enemy)
+        fights_hit = fights[aoe[hit]]
+        hits.append((fights_hit, self.at[fights_hit, splashed[hit, k]], self.splash[at][aoe[hit]],
+                     np.full(len(hit), PHYSICAL)))
+        nova = np.flatnonzero(ability_kind == NOVA)
+        hit, tile = np.nonzero(enemy[cast[nova], :size] & (self.dist[here[cast[nova]]] <= self.reach[at][nova, None]))
+        fights_hit = fights[nova[hit]]
+        hits.append((fights_hit, self.at[fights_hit, tile], self.power[at][nova[hit]],
+                     self.damage_type[at][nova[hit]]))
+        fast = self.fastcast[fights, slots]
+        ends.append(cast[~fast])
+        ends.append(self.spend_move(cast[fast], rows, actor))
+
+        self.take_damage(*(np.concatenate(column) for column in zip(*hits)))
+        ends = np.concatenate(ends)
+        self.end_act(rows[ends], actor[ends])
+
+    def spend_move(self, which, rows, actor):
+        """Uses a free move of the creatures that have one, returns the others, whose act ends."""
+        fights, slots = rows[which], actor[which]
+        free = self.free_moves[fights, slots] > 0
+        self.free_moves[fights[free], slots[free]] -= 1
+        return which[~free]
+
+    def end_act(self, fights, slots):
+        self.next_action[fights, slots] += 100
+        self.free_moves[fights, slots] = self.moves[fights, slots]
+        self.shield[fights, slots] = np.maximum(self.shield[fights, slots], self.shield_passive[fights, slots])
+
+    def take_damage(self, fights, slots, number, damage_type):
+        """Creature.take_damage for a batch, slots being alive and distinct within a fight."""
+        at = fights, slots
+        resist = np.where(damage_type == PHYSICAL, self.armor[at], np.where(damage_type == MAGIC, self.magic_resist[at], 0))
+        number = np.where(resist > 0, np.round(10 * number / (10 + np.maximum(resist, 0))).astype(np.int64), number)
+        shield = self.shield[at]
+        left = shield - number
+        self.health[at] = np.where(shield != 0, self.health[at] + np.minimum(left, 0), self.health[at] - number)
+        self.shield[at] = np.where(shield != 0, np.maximum(left, 0), shield)
+        dead = self.health[at] <= 0
+        fights, slots = fights[dead], slots[dead]
+        self.alive[fights, slots] = False
+        self.at[fights, self.tile[fights, slots]] = -1
+
+    def new_turn(self, rows):
+        """Combat.new_turn for a batch, ties going to the lower slot as in the timeline."""
+        alive = self.alive[rows]
+        is_pc = self.is_pc[rows]
+        self.over[rows] = ~(alive & is_pc).any(1) | ~(alive & ~is_pc).any(1)
+        rows = rows[~self.over[rows]]
+        slots = self.alive.shape[1]
+        key = np.where(self.alive[rows], self.next_action[rows] * slots + np.arange(slots), np.iinfo(np.int64).max)
+        peek = key.argmin(1)
+        changed = peek != self.to_act[rows]
+        rows, peek = rows[changed], peek[changed]
+        self.to_act[rows] = peek
+        now = self.next_action[rows, peek]
+        elapsed = now - self.turn[rows]
+        self.turn[rows] = now
+        # Regeneration ticks, the only passive on the clock
+        health = self.health[rows]
+        rate = self.regen_rate[rows]
+        ticks = self.alive[rows] & (rate > 0) & (health < self.regen_cap[rows])
+        gain = np.round(elapsed[:, None] / 100 * rate).astype(np.int64)
+        self.health[rows] = np.where(ticks, health + gain, health)
+
+    def build_lines(self, sources):
+        """Fills lines[source, target, tile] from Board.line for the sources not seen yet."""
+        tiles = self.board.tiles
+        for i in np.unique(sources[~self.lines_built[sources]]):
+            for j, target in enumerate(tiles):
+                mask = self.board.line(tiles[i], target).to_bytes(self.size // 8 + 1, 'little')
+                self.lines[i, j] = np.unpackbits(np.frombuffer(mask, np.uint8), bitorder='little')[:self.size]
+            self.lines_built[i] = True
+
+    def outcome(self, fight):
+        """Comparable with the outcome function of an object fight."""
+        return (int(self.turn[fight]), int(self.actions[fight]),
+                tuple((int(self.health[fight, slot]), int(self.shield[fight, slot]), int(self.tile[fight, slot]),
+                       bool(self.alive[fight, slot])) for slot in range(len(self.alive[fight]))
+                      if self.tile[fight, slot] >= 0))
+
+    def pc_won(self):
+        return self.over & (self.alive & self.is_pc).any(1)
+
+
+def check(creature):
+    unsupported = [type(ability).__name__ for ability in creature.abilities
+                   if type(ability) not in ABILITY_KINDS or ability.is_instant]
+    unsupported += [type(passive).__name__ for passive in creature.passives if not isinstance(passive, PASSIVE_KINDS)]
+    if sum(isinstance(passive, RegenerationPassive) for passive in creature.passives) > 1:
+        unsupported.append('RegenerationPassive twice')
+    unsupported += [status.name for status in creature.status]
+    if unsupported:
+        raise ValueError('%s: %s not supported by the kernel' % (creature.name, ', '.join(unsupported)))
+
+
+def outcome(combat, actions):
+    """Turn, actions and the state of every creature of the roster once an object fight is played."""
+    return (combat.turn, actions,
+            tuple((c.health, c.shield, combat.board.index[c.tile], combat.creatures.get(c.tile) is c)
+                  for c in combat.roster))
+
+
+def new_combats(party, mobs, seeds):
+    from simulate import make_party
+    combats = []
+    for seed in seeds:
+        combat = Combat(zip(make_party(party), FORMATION), mobs, seed)
+        combat.new_turn()
+        combats.append(combat)
+    return combats
+
+
+def cross_check(party, mobs, seeds, max_actions=MAX_ACTIONS):
+    """Seeds whose fight does not end the same in the kernel and in the object engine."""
+    combats = new_combats(party, mobs, seeds)
+    kernel = Kernel(combats)
+    kernel.run(max_actions)
+    mismatches = []
+    for fight, (seed, combat) in enumerate(zip(seeds, combats)):
+        actions = 0
+        while not combat.is_over() and actions < max_actions:
+            combat.play(combat.ai_action())
+            actions += 1
+        if kernel.outcome(fight) != outcome(combat, actions):
+            mismatches.append(seed)
+    return mismatches
+
+
+def main(argv=None):
+    from simulate import parse_party, parse_mobs
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--party', default='Fighter,Barbarian,Archer,Wizard')
+    parser.add_argument('--mobs', required=True)
+    parser.add_argument('--seeds', default='0:1000', help='first:last, last excluded')
+    parser.add_argument('--batch', type=int, default=1000, help='fights per kernel')
+    parser.add_argument('--check', action='store_true', help='play the fights with the objects too and compare')
+    args = parser.parse_args(argv)
+    party, mobs = parse_party(args.party), parse_mobs(args.mobs)
+    first, last = (int(x) for x in args.seeds.split(':'))
+    fights = wins = draws = 0
+    mismatches = []
+    start = time.perf_counter()
+    for batch in range(first, last, args.batch):
+        seeds = range(batch, min(last, batch + args.batch))
+        if args.check:
+            mismatches += cross_check(party, mobs, seeds)
+            continue
+        kernel = Kernel(new_combats(party, mobs, seeds))
+        kernel.run()
+        fights += len(seeds)
+        wins += kernel.pc_won().sum()
+        draws += (~kernel.over).sum()
+    elapsed = time.perf_counter() - start
+    if args.check:
+        print('fights %d  mismatches %d %s' % (last - first, len(mismatches), mismatches[:20]))
+    else:
+        print('fights %d  win rate %.3f  draws %d' % (fights, wins / max(1, fights), draws))
+    print('%.1f fights per second' % ((last - first) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Monte Carlo tree search over the combat rules, usable as Combat.searchers policy.
+
+    python mcts.py --mobs Skeleton*6,SkeletonArcher*2 --side mobs --budget 20 --workers 4 --fights 5
+"""
+from combat import Combat, FORMATION
+from multiprocessing import Pool, TimeoutError
+from math import log, sqrt
+import argparse
+import random
+import time
+
+
+# Share of the budget that workers leave to send their results back before the deadline
+RESULT_MARGIN = 0.2
+
+
+def evaluate(combat):
+    """Value of the fight for the PCs, between 0 and 1."""
+    if combat.is_over():
+        return 1 if combat.pc_mask else 0
+    pcs = sum(c.health / c.maxhealth for c in combat.creatures.values() if c.is_pc)
+    mobs = sum(c.health / c.maxhealth for c in combat.creatures.values() if not c.is_pc)
+    return pcs / (pcs + mobs)
+
+
+class Node:
+    __slots__ = ('mover_is_pc', 'children', 'untried', 'visits', 'value')
+
+    def __init__(self, mover_is_pc):
+        # Side of the creature whose action led here, value is counted for that side
+        self.mover_is_pc = mover_is_pc
+        self.children = {}
+        self.untried = None
+        self.visits = 0
+        self.value = 0
+
+    def select(self, exploration):
+        log_visits = log(self.visits)
+        return max(self.children.items(),
+                   key=lambda kv: kv[1].value / kv[1].visits + exploration * sqrt(log_visits / kv[1].visits))
+
+
+class MCTS:
+    """UCT search, with rollouts played by the scripted AI.
+
+    The tree is kept between decisions and walked down the actions played
+    since, as long as the fight goes on. With workers > 1, as many trees are
+    grown in parallel in other processes from a replay of the fight, and the
+    visit counts at the root are summed. Workers search up to the same deadline
+    as this process, less a margin to send their results back, and results
+    that come later are left out."""
+    def __init__(self, budget_ms=20, exploration=0.7, rollout_depth=40, workers=1, seed=0):
+        self.budget = budget_ms / 1000
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.seed = seed
+        # Started here so that forking the workers is not paid by the first decision
+        self.pool = Pool(workers - 1) if workers > 1 else None
+        self.combat = None
+        self.root = None
+        self.root_history = 0
+        self.decision_times = []
+
+    def decide(self, combat):
+        start = time.perf_counter()
+        # perf_counter is system wide, so workers can be given the same deadline
+        deadline = start + self.budget
+        actions = combat.legal_actions()
+        if len(actions) == 1:
+            action = actions[0]
+        else:
+            self.move_root(combat)
+            jobs = self.start_workers(combat, deadline) if self.pool else []
+            self.search(combat, self.root, deadline)
+            stats = {action: child.visits for action, child in self.root.children.items()}
+            for job in jobs:
+                try:
+                    visits = job.get(timeout=max(0, deadline - time.perf_counter()))
+                except TimeoutError:
+                    continue
+                for action, n in visits.items():
+                    stats[action] = stats.get(action, 0) + n
+            action = max(stats, key=stats.get)
+        self.decision_times.append(1000 * (time.perf_counter() - start))
+        return action
+
+    def move_root(self, combat):
+        """Reuses the subtree reached by the actions played since the last decision, if any."""
+        node = self.root if combat is self.combat else None
+        for action in combat.history[self.root_history:] if node else ():
+            node = node.children.get(action)
+            if node is None:
+                break
+        self.combat = combat
+        self.root = node or Node(not combat.to_act.is_pc)
+        self.root_history = len(combat.history)
+
+    def search(self, combat, root, deadline):
+        snapshot = combat.snapshot()
+        # Searched plays are not part of the fight
+        with combat.events.muted():
+            while True:
+                self.iterate(combat, root, deadline)
+                combat.restore(snapshot)
+                if time.perf_counter() >= deadline:
+                    break
+
+    def iterate(self, combat, root, deadline):
+        node = root
+        path = [root]
+        while not combat.is_over():
+            # The root is always grown, so that every search has a child to pick
+            if node is not root and time.perf_counter() >= deadline:
+                break
+            if node.untried is None:
+                node.untried = combat.legal_actions()
+                self.rng.shuffle(node.untried)
+            if node.untried:
+                action = node.untried.pop()
+                mover_is_pc = combat.to_act.is_pc
+                combat.play(action)
+                node.children[action] = node = Node(mover_is_pc)
+                path.append(node)
+                break
+            action, node = node.select(self.exploration)
+            combat.play(action)
+            path.append(node)
+        for depth in range(self.rollout_depth):
+            # Rollouts are cut short rather than overrun the budget
+            if combat.is_over() or time.perf_counter() >= deadline:
+                break
+            combat.play(combat.to_act.ai_action(self.rng))
+        reward = evaluate(combat)
+        for node in path:
+            node.visits += 1
+            node.value += reward if node.mover_is_pc else 1 - reward
+
+    def start_workers(self, combat, deadline):
+        rng_states = [(name, stream.getstate()) for name, stream in combat.rng.streams.items()]
+        # Workers replay from the setup, so that they do not search in a copy of the combat object
+        job = (type(combat), combat.setup, list(combat.history), rng_states,
+               deadline - self.budget * RESULT_MARGIN, self.exploration, self.rollout_depth)
+        return [self.pool.apply_async(_search_job, job + (self.seed * 7919 + len(combat.history) * 31 + i,))
+                for i in range(1, self.workers)]
+
+    def percentiles(self, *ranks):
+        """Decision times in ms at the given percentile ranks."""
+        times = sorted(self.decision_times)
+        if not times:
+            return [0 for _ in ranks]
+        return [times[min(len(times) - 1, int(rank / 100 * len(times)))] for rank in ranks]
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+
+# Fight replayed by this worker process, advanced by the actions played since its last job
+_replayed = None
+
+
+def _search_job(combat_class, setup, history, rng_states, deadline, exploration, rollout_depth, seed):
+    global _replayed
+    combat = _replayed
+    if combat is None or combat.setup != setup or combat.history != history[:len(combat.history)]:
+        combat = Combat.replay(setup, [], combat_class)
+    for action in history[len(combat.history):]:
+        combat.play(action)
+    _replayed = combat
+    for name, state in rng_states:
+        combat.rng[name].setstate(state)
+    search = MCTS(exploration=exploration, rollout_depth=rollout_depth, seed=seed)
+    root = Node(not combat.to_act.is_pc)
+    search.search(combat, root, deadline)
+    return {action: child.visits for action, child in root.children.items()}
+
+
+def main(argv=None):
+    from simulate import parse_party, parse_mobs, make_party, SIDES
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--party', default='Fighter,Barbarian,Archer,Wizard,Enchantress')
+    parser.add_argument('--mobs', required=True)
+    parser.add_argument('--side', choices=['mobs', 'pcs', 'both'], default='mobs')
+    parser.add_argument('--budget', type=float, default=20, help='ms per decision')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--fights', type=int, default=5)
+    args = parser.parse_args(argv)
+    search = MCTS(args.budget, workers=args.workers)
+    wins = 0
+    for seed in range(args.fights):
+        combat = Combat(zip(make_party(parse_party(args.party)), FORMATION), parse_mobs(args.mobs), seed)
+        combat.searchers = {is_pc: search for is_pc in SIDES[args.side]}
+        combat.new_turn()
+        while not combat.is_over():
+            combat.play(combat.ai_action())
+        wins += bool(combat.pc_mask)
+    search.close()
+    print('fights %d  pc wins %d' % (args.fights, wins))
+    print('decisions %d  ms p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % (
+        (len(search.decision_times),) + tuple(search.percentiles(50, 90, 99, 100))))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,21 @@
+# Hooks a passive can implement, called by the creature it is on:
+#   on_tick(creature, elapsed_time)       every clock advance of the combat
+#   on_end_act(creature)                  after the creature's act ended
+#   on_use_ability(creature, ability)     after a non instant ability, True if it paid for the act
+#   on_end_combat(creature)               when the fight is over, still in combat
+HOOKS = ('on_tick', 'on_end_act', 'on_use_ability', 'on_end_combat')
+
+
+def dispatch_table(passives):
+    """Hook name -> tuple of the bound hooks of passives, in passive order, for the hooks that have any."""
+    table = {}
+    for name in HOOKS:
+        hooks = tuple(getattr(passive, name) for passive in passives if hasattr(passive, name))
+        if hooks:
+            table[name] = hooks
+    return table
+
+
 class Passive:
     def __init__(self, image_name, **kwargs):
         self.image_name = image_name
@@ -10,21 +28,12 @@ class Passive:
 
 
 class RegenerationPassive(Passive):
-    def apply_to(self, creature):
-        old_tick = creature.tick
-
-        def new_tick(elapsed_time):
-            old_tick(elapsed_time)
-            if creature.health < (self.maxhealth or creature.maxhealth):
-                creature.health += round(elapsed_time / 100 * self.rate)
-        creature.tick = new_tick
+    def on_tick(self, creature, elapsed_time):
+        if creature.health < (self.maxhealth or creature.maxhealth):
+            creature.health += round(elapsed_time / 100 * self.rate)
 
-        old_end_game = creature.end_combat
-
-        def new_end_game():
-            old_end_game()
-            creature.health = max(creature.health, self.maxhealth or creature.maxhealth)
-        creature.end_combat = new_end_game
+    def on_end_combat(self, creature):
+        creature.health = max(creature.health, self.maxhealth or creature.maxhealth)
 
     def get_short_desc(self):
         t = 'Regen %d' % self.rate
@@ -40,16 +49,11 @@ class RegenerationPassive(Passive):
 
 
 class HealPassive(Passive):
-    def apply_to(self, creature):
-        old_end_combat = creature.end_combat
-
-        def new_end_combat():
-            for cr in creature.combat.creatures.values():
-                if cr.health > 0:
-                    cr.health += self.amount
-                    cr.health = min(cr.health, cr.maxhealth)
-            old_end_combat()
-        creature.end_combat = new_end_combat
+    def on_end_combat(self, creature):
+        for cr in creature.combat.creatures.values():
+            if cr.health > 0:
+                cr.health += self.amount
+                cr.health = min(cr.health, cr.maxhealth)
 
     def get_short_desc(self):
         t = 'Heal %d' % self.amount
@@ -61,13 +65,8 @@ class HealPassive(Passive):
 
 
 class ShieldPassive(Passive):
-    def apply_to(self, creature):
-        old_end_act = creature.end_act
-
-        def end_act():
-            old_end_act()
-            creature.shield = max(creature.shield, self.shield)
-        creature.end_act = end_act
+    def on_end_act(self, creature):
+        creature.shield = max(creature.shield, self.shield)
 
     def get_short_desc(self):
         return 'Shield %d' % self.shield
@@ -77,21 +76,12 @@ class ShieldPassive(Passive):
 
 
 class Fastcast(Passive):
-    def apply_to(self, creature):
-        old_use = creature.use_ability
-
-        def use_ability(ability, target):
-            old_ability_instant = ability.is_instant
-            ability.is_instant = True
-            old_use(ability, target)
-            if old_ability_instant:
-                return
-            if creature.free_moves:
-                creature.free_moves -= 1
-            else:
-                creature.end_act()
-            ability.is_instant = old_ability_instant
-        creature.use_ability = use_ability
+    def on_use_ability(self, creature, ability):
+        if creature.free_moves:
+            creature.free_moves -= 1
+        else:
+            creature.end_act()
+        return True
 
     def get_short_desc(self):
         return 'Fastcast'
@@ -103,7 +93,7 @@ class Fastcast(Passive):
 class Quick(Passive):
     def apply_to(self, creature):
         total_moves = self.bonus_moves + 1
-        creature.FREE_MOVES = total_moves
+        creature.max_free_moves = total_moves
 
     def get_short_desc(self):
         return 'Quick %d' % self.bonus_moves
@@ -0,0 +1,55 @@
+"""A* over hex grids of GameTile, passability being given by the caller."""
+from itertools import count
+import heapq
+
+
+def astar(start, goal, passable):
+    """Shortest list of tiles stepping from start to goal, start excluded, or None when there is none.
+
+    passable(tile) tells whether a path may enter tile, the goal included. Every step
+    costs 1 and hex distance is the heuristic. Ties go to the tiles closest to goal."""
+    if start == goal:
+        return []
+    order = count()
+    frontier = [(start.hex_dist(goal), 0, next(order), start)]
+    came_from = {start: None}
+    steps = {start: 0}
+    while frontier:
+        _, negative_steps, _, tile = heapq.heappop(frontier)
+        if tile == goal:
+            path = []
+            while tile != start:
+                path.append(tile)
+                tile = came_from[tile]
+            return path[::-1]
+        if -negative_steps > steps[tile]:
+            continue
+        next_steps = steps[tile] + 1
+        for neighbour in tile.neighbours():
+            if next_steps >= steps.get(neighbour, next_steps + 1) or not passable(neighbour):
+                continue
+            steps[neighbour] = next_steps
+            came_from[neighbour] = tile
+            heapq.heappush(frontier, (next_steps + neighbour.hex_dist(goal), -next_steps, next(order), neighbour))
+    return None
+
+
+class PathCache:
+    """Paths by (start, goal), kept as long as the version they were planned at.
+
+    The version stands for whatever passability depends on, such as the tiles
+    of a map and how much of it was seen."""
+    def __init__(self):
+        self.paths = {}
+        self.version = None
+
+    def path(self, start, goal, passable, version):
+        """astar(start, goal, passable) as a tuple, or None."""
+        if version != self.version:
+            self.paths = {}
+            self.version = version
+        key = (start, goal)
+        if key not in self.paths:
+            path = astar(start, goal, passable)
+            self.paths[key] = None if path is None else tuple(path)
+        return self.paths[key]
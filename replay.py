@@ -0,0 +1,243 @@
+"""Fights archived as their setup and action stream, with state keyframes to seek quickly.
+
+    python replay.py fight.hxr --action 120
+    python replay.py fight.hxr --turn 800 --show
+
+A file is a header, then one zlib stream holding the actions as uint16 codes
+followed by a JSON blob with the setup and a keyframe every `interval` actions:
+
+    magic 'HXRP', version (B), interval (H), action count (I), JSON length (I)
+
+Action codes are 0 for idle, 1 + tile for a move and 1 + (1 + slot) * board
+size + tile for an ability, tiles being board indices. A move off the board,
+which does nothing, is OFF_BOARD.
+
+The actions come from Combat.history, not from the event bus. Events are what
+the actions caused: an idle or a move off the board causes none, so they could
+not be played back from the events.
+"""
+from combat import Combat
+from creatures import Creature
+from board import Board
+from rng import RandomStreams
+from status import STATUSES
+import argparse
+import heapq
+import json
+import struct
+import zlib
+
+MAGIC = b'HXRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBHII')
+KEYFRAME_INTERVAL = 64
+OFF_BOARD = 0xFFFF
+
+
+def encode_action(board, action):
+    if action[0] == 'idle':
+        return 0
+    if action[0] == 'move':
+        i = board.index.get(action[1])
+        return OFF_BOARD if i is None else 1 + i
+    return 1 + (1 + action[1]) * len(board) + board.index[action[2]]
+
+
+def decode_action(board, code):
+    if code == 0:
+        return ('idle',)
+    if code == OFF_BOARD:
+        return ('move', None)
+    slot, i = divmod(code - 1, len(board))
+    if slot == 0:
+        return ('move', board.tiles[i])
+    return ('ability', slot - 1, board.tiles[i])
+
+
+def keyframe(combat):
+    """State of combat as plain JSON data, creatures being roster indices and tiles board indices."""
+    index = {creature: i for i, creature in enumerate(combat.roster)}
+    board = combat.board
+    creatures = []
+    for creature in combat.roster:
+        creatures.append({
+            'defkey': creature.defkey, 'is_pc': creature.is_pc,
+            'stats': [creature.health, creature.maxhealth, creature.damage, creature.armor, creature.magic_resist,
+                      creature.shield, creature.free_moves, creature.next_action],
+            'tile': board.index[creature.tile],
+            'passives': bool(creature.passives),
+            'status': [[status.name, {k: v for k, v in vars(status).items() if k != 'clock'}]
+                       for status in creature.status],
+            'rooted': [creature.status.index(status) for status in creature.rooted],
+            'silenced': [creature.status.index(status) for status in creature.silenced],
+            'cooldowns': [None if ability.clock is None else ability.ready_at for ability in creature.abilities],
+        })
+    entries, arrival, sequence = combat.timeline.snapshot()
+    return {
+        'turn': combat.turn,
+        'to_act': index.get(combat.to_act),
+        'actions': len(combat.history),
+        'creatures': creatures,
+        'standing': [index[creature] for creature in combat.creatures.values()],
+        'timeline': [[[na, n, seq, index[c]] for na, n, seq, c in entries],
+                     [[index[c], n] for c, n in arrival.items()], sequence],
+        # Timers of removed statuses do nothing once due, they are left out
+        'timers': sorted([wake, seq, index[c], c.status.index(status)] for wake, seq, status, c in combat.timers
+                         if status in c.status),
+        'timer_sequence': combat.timer_sequence,
+        'tickers': [index[c] for c in combat.tickers],
+        'rng': combat.rng.dict_dump(),
+    }
+
+
+def restore_keyframe(combat, frame, history):
+    """Brings combat, a replay of the same setup, to frame. history is the actions played up to it."""
+    board = combat.board
+    for i, data in enumerate(frame['creatures']):
+        if i == len(combat.roster):
+            # Summoned during the fight
+            creature = Creature(data['defkey'], is_pc=data['is_pc'])
+            creature.combat = combat
+            combat.roster.append(creature)
+        creature = combat.roster[i]
+        (creature.health, creature.maxhealth, creature.damage, creature.armor, creature.magic_resist,
+         creature.shield, creature.free_moves, creature.next_action) = data['stats']
+        creature.tile = board.tiles[data['tile']]
+        if not data['passives']:
+            creature.set_passives([])
+        creature.status = []
+        for name, attributes in data['status']:
+            status = STATUSES[name][0].__new__(STATUSES[name][0])
+            vars(status).update(attributes)
+            status.clock = combat
+            creature.status.append(status)
+        creature.rooted = [creature.status[k] for k in data['rooted']]
+        creature.silenced = [creature.status[k] for k in data['silenced']]
+        for ability, ready_at in zip(creature.abilities, data['cooldowns']):
+            ability.clock = None if ready_at is None else combat
+            ability.ready_at = ready_at or 0
+    roster = combat.roster
+    combat.creatures = {}
+    for i in frame['standing']:
+        combat.creatures[roster[i].tile] = roster[i]
+    combat.spatial.load(combat.creatures)
+    entries, arrival, sequence = frame['timeline']
+    combat.timeline.restore((tuple((na, n, seq, roster[i]) for na, n, seq, i in entries),
+                             {roster[i]: n for i, n in arrival}, sequence))
+    combat.timers = [(wake, seq, roster[i].status[k], roster[i]) for wake, seq, i, k in frame['timers']]
+    heapq.heapify(combat.timers)
+    combat.timer_sequence = frame['timer_sequence']
+    combat.tickers = [roster[i] for i in frame['tickers']]
+    combat.rng = RandomStreams.dict_load(frame['rng'])
+    combat.turn = frame['turn']
+    combat.to_act = None if frame['to_act'] is None else roster[frame['to_act']]
+    combat.history = list(history)
+    combat.occupancy_changed()
+
+
+def dumps(combat, interval=KEYFRAME_INTERVAL):
+    """Replay file contents for combat, from its setup and history.
+
+    The fight is played again from the setup to take the keyframes."""
+    replayed = Combat.replay(combat.setup, [], type(combat))
+    keyframes = []
+    for n, action in enumerate(combat.history):
+        if n and n % interval == 0:
+            keyframes.append(keyframe(replayed))
+        replayed.play(action)
+    codes = [encode_action(combat.board, action) for action in combat.history]
+    blob = json.dumps({'setup': combat.setup, 'keyframes': keyframes}, separators=(',', ':')).encode()
+    header = HEADER.pack(MAGIC, VERSION, interval, len(codes), len(blob))
+    return header + zlib.compress(struct.pack('<%dH' % len(codes), *codes) + blob, 9)
+
+
+def save(combat, path, interval=KEYFRAME_INTERVAL):
+    with open(path, 'wb') as f:
+        f.write(dumps(combat, interval))
+
+
+class Replay:
+    """A loaded replay file, played back from the nearest keyframe."""
+    def __init__(self, data, combat_class=Combat):
+        magic, version, self.interval, count, length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a replay file, or of another version')
+        body = zlib.decompress(data[HEADER.size:])
+        codes = struct.unpack('<%dH' % count, body[:2 * count])
+        blob = json.loads(body[2 * count:2 * count + length])
+        self.combat_class = combat_class
+        self.setup = blob['setup']
+        self.keyframes = blob['keyframes']
+        board = Board.of_radius(combat_class.MAP_RADIUS)
+        self.actions = [decode_action(board, code) for code in codes]
+
+    @staticmethod
+    def load(path, combat_class=Combat):
+        with open(path, 'rb') as f:
+            return Replay(f.read(), combat_class)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def seek(self, n):
+        """A new combat as it was after the first n actions."""
+        n = max(0, min(n, len(self.actions)))
+        combat = Combat.replay(self.setup, [], self.combat_class)
+        k = min(n // self.interval, len(self.keyframes))
+        if k:
+            restore_keyframe(combat, self.keyframes[k - 1], self.actions[:k * self.interval])
+        for action in self.actions[k * self.interval:n]:
+            combat.play(action)
+        return combat
+
+    def seek_turn(self, turn):
+        """A new combat at the first action reaching turn on the combat clock, or at the end."""
+        k = 0
+        while k < len(self.keyframes) and self.keyframes[k]['turn'] < turn:
+            k += 1
+        combat = self.seek(k * self.interval)
+        while combat.turn < turn and len(combat.history) < len(self.actions):
+            combat.play(self.actions[len(combat.history)])
+        return combat
+
+
+def describe(combat):
+    """Headless dump of a combat, line by line."""
+    yield 'action %d  turn %d  to act %s' % (len(combat.history), combat.turn,
+                                             combat.to_act.name if combat.to_act else '-')
+    for creature in combat.roster:
+        alive = combat.creatures.get(creature.tile) is creature
+        yield '  %-3s %-16s %-10s hp %3d/%-3d shield %2d  next %5d  %s' % (
+            'pc' if creature.is_pc else 'mob', creature.name, creature.tile.dict_dump() if alive else 'dead',
+            creature.health, creature.maxhealth, creature.shield, creature.next_action,
+            ' '.join(status.name for status in creature.status))
+
+
+def show(replay, combat):
+    from display import DISPLAY
+    from combat_ui import ReplayInterface
+    DISPLAY.setup()
+    ReplayInterface(replay, combat).activate()
+    DISPLAY.main()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--action', type=int, help='number of actions played')
+    parser.add_argument('--turn', type=int, help='combat clock')
+    parser.add_argument('--show', action='store_true', help='open the fight in the game window')
+    args = parser.parse_args(argv)
+    replay = Replay.load(args.path)
+    if args.turn is not None:
+        combat = replay.seek_turn(args.turn)
+    else:
+        combat = replay.seek(len(replay) if args.action is None else args.action)
+    if args.show:
+        show(replay, combat)
+    for line in describe(combat):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
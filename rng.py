@@ -0,0 +1,63 @@
+import random
+
+# Words of Mersenne Twister state, regenerated all at once
+BLOCK = 624
+
+
+class RandomStreams:
+    """Independent random.Random streams derived by name from a single seed.
+
+    Each subsystem draws from its own stream, so that adding a roll in one
+    does not shift the others, and the same seed replays the same run in any
+    process (string seeds are hashed with sha512, not with hash())."""
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.streams = {}
+
+    def __getitem__(self, name):
+        if name not in self.streams:
+            self.streams[name] = random.Random('%s/%s' % (self.seed, name))
+        return self.streams[name]
+
+    def derive(self, name):
+        """New streams for a sub-part, such as a single combat."""
+        return RandomStreams('%s/%s' % (self.seed, name))
+
+    def tell(self, name, limit=64):
+        """Number of 32 bit words drawn from stream name, None if past limit state blocks or after gauss.
+
+        Every draw of random.Random takes whole words, so drawing as many words
+        from a fresh stream brings it to the same state."""
+        version, state, gauss = self[name].getstate()
+        if gauss is not None:
+            return None
+        fresh = random.Random('%s/%s' % (self.seed, name))
+        if fresh.getstate()[1] == state:
+            return 0
+        for block in range(limit):
+            # The state is regenerated every BLOCK words
+            fresh.getrandbits(32 * BLOCK)
+            if fresh.getstate()[1][:-1] == state[:-1]:
+                return BLOCK * block + state[-1]
+        return None
+
+    def dict_dump(self):
+        streams = {}
+        for name, stream in self.streams.items():
+            words = self.tell(name)
+            streams[name] = stream.getstate() if words is None else words
+        return {'seed': self.seed, 'streams': streams}
+
+    @staticmethod
+    def dict_load(data):
+        streams = RandomStreams(data['seed'])
+        for name, state in data['streams'].items():
+            if isinstance(state, int):
+                if state:
+                    streams[name].getrandbits(32 * state)
+            else:
+                version, words, gauss = state
+                streams[name].setstate((version, tuple(words), gauss))
+        return streams
@@ -0,0 +1,202 @@
+"""Plays many headless fights with the AI on both sides and reports statistics.
+
+    python simulate.py --party Fighter+Bloodluster,Barbarian,Archer,Wizard,Enchantress \
+        --mobs Skeleton*6,SkeletonArcher*2 --seeds 0:10000 --workers 8
+"""
+from combat import Combat, FORMATION
+from creatures import Creature
+from items import ITEMS
+from mcts import MCTS
+from events import Damage
+from collections import Counter
+from multiprocessing import Pool
+from math import sqrt
+import argparse
+
+MAX_ACTIONS = 3000
+HP_BUCKETS = 10
+SIDES = {'mobs': (False,), 'pcs': (True,), 'both': (True, False)}
+
+
+def parse_party(spec):
+    """'Fighter+Bloodluster,Archer' -> [('Fighter', ['Bloodluster']), ('Archer', [])]"""
+    party = []
+    for member in spec.split(','):
+        defkey, *items = member.split('+')
+        party.append((defkey, items))
+    return party
+
+
+def parse_mobs(spec):
+    """'Skeleton*6,SkeletonArcher*2' -> ['Skeleton'] * 6 + ['SkeletonArcher'] * 2"""
+    mobs = []
+    for group in spec.split(','):
+        defkey, _, number = group.partition('*')
+        mobs += [defkey] * int(number or 1)
+    return mobs
+
+
+def make_party(party):
+    pcs = []
+    for defkey, item_names in party:
+        pc = Creature(defkey, is_pc=True)
+        for name in item_names:
+            ITEMS[name][0](*ITEMS[name][1]).equip(pc)
+        pcs.append(pc)
+    return pcs
+
+
+def fight(party, mobs, seed, search=None):
+    """Plays one fight and returns a small summary, so that results stay cheap to send between processes.
+
+    search is None for the scripted AI, or (side, budget in ms) to have MCTS play side."""
+    pcs = make_party(party)
+    combat = Combat(zip(pcs, FORMATION), mobs, seed)
+    damage = Counter()
+
+    def count_damage(event):
+        label = '%s attack' % event.source.name if isinstance(event.source, Creature) else event.source.name
+        damage['party' if not event.target.is_pc else 'mobs', label] += event.amount
+    combat.events.subscribe(count_damage, Damage)
+    searcher = None
+    if search:
+        searcher = MCTS(search[1], seed=seed)
+        combat.searchers = {is_pc: searcher for is_pc in SIDES[search[0]]}
+    combat.new_turn()
+    actions = 0
+    while not combat.is_over() and actions < MAX_ACTIONS:
+        combat.play(combat.ai_action())
+        actions += 1
+    result = {
+        'won': combat.is_over() and any(c.is_pc for c in combat.creatures.values()),
+        'draw': not combat.is_over(),
+        'actions': actions,
+        'time': combat.turn,
+        'damage': damage,
+        'health': [max(0, pc.health) / pc.maxhealth for pc in pcs],
+        'decisions': searcher.decision_times if searcher else [],
+    }
+    combat.release()
+    return result
+
+
+class Report:
+    """Aggregates fight summaries as they come, in constant memory."""
+    def __init__(self, party):
+        self.names = [defkey for defkey, _ in party]
+        self.fights = 0
+        self.wins = 0
+        self.draws = 0
+        self.time = RunningStat()
+        self.actions = RunningStat()
+        self.damage = Counter()
+        self.health = [[0] * (HP_BUCKETS + 1) for _ in party]
+        # Search decision times, by tenth of ms
+        self.decisions = Counter()
+
+    def add(self, result):
+        self.fights += 1
+        self.wins += result['won']
+        self.draws += result['draw']
+        self.time.add(result['time'])
+        self.actions.add(result['actions'])
+        self.damage.update(result['damage'])
+        for histogram, health in zip(self.health, result['health']):
+            # Bucket 0 is dead, then tenths of maxhealth
+            histogram[0 if health <= 0 else 1 + min(HP_BUCKETS - 1, int(health * HP_BUCKETS))] += 1
+        self.decisions.update(int(ms * 10) for ms in result['decisions'])
+
+    def decision_percentiles(self, *ranks):
+        total = sum(self.decisions.values())
+        result = []
+        for rank in ranks:
+            seen = 0
+            for bucket in sorted(self.decisions):
+                seen += self.decisions[bucket]
+                if seen >= rank / 100 * total:
+                    result.append((bucket + 1) / 10)
+                    break
+        return result
+
+    def lines(self):
+        yield 'fights %d  win rate %.3f  draws %d' % (self.fights, self.wins / max(1, self.fights), self.draws)
+        yield 'clock  %s' % self.time
+        yield 'actions %s' % self.actions
+        yield 'damage per fight:'
+        for (side, label), amount in sorted(self.damage.items(), key=lambda kv: (kv[0][0], -kv[1])):
+            yield '  %-5s %-22s %8.1f' % (side, label, amount / max(1, self.fights))
+        yield 'surviving health (dead, 0-10%, ..., 90-100%):'
+        for name, histogram in zip(self.names, self.health):
+            yield '  %-12s %s' % (name, ' '.join('%5.1f' % (100 * n / max(1, self.fights)) for n in histogram))
+        if self.decisions:
+            yield 'search decisions %d  ms p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % (
+                (sum(self.decisions.values()),) + tuple(self.decision_percentiles(50, 90, 99, 100)))
+
+
+class RunningStat:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        # Welford's online mean and variance
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+
+    def __str__(self):
+        std = sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0
+        return 'mean %.1f  std %.1f  min %s  max %s' % (self.mean, std, self.min, self.max)
+
+
+_job = None
+
+
+def _init_worker(party, mobs, search):
+    global _job
+    _job = (party, mobs, search)
+
+
+def _fight_seed(seed):
+    return fight(_job[0], _job[1], seed, _job[2])
+
+
+def simulate(party, mobs, seeds, workers=1, search=None):
+    """Yields the summary of the fight of every seed, in completion order."""
+    if workers <= 1:
+        for seed in seeds:
+            yield fight(party, mobs, seed, search)
+        return
+    # Chunks big enough to amortize the IPC, small enough to keep every worker busy until the end
+    chunksize = max(1, min(256, len(seeds) // (workers * 16)))
+    with Pool(workers, _init_worker, (party, mobs, search)) as pool:
+        yield from pool.imap_unordered(_fight_seed, seeds, chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--party', default='Fighter,Barbarian,Archer,Wizard,Enchantress')
+    parser.add_argument('--mobs', required=True)
+    parser.add_argument('--seeds', default='0:1000', help='first:last, last excluded')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--search', choices=sorted(SIDES), help='side played by MCTS instead of the script')
+    parser.add_argument('--budget', type=float, default=20, help='MCTS ms per decision')
+    args = parser.parse_args(argv)
+    search = (args.search, args.budget) if args.search else None
+    party = parse_party(args.party)
+    first, last = (int(x) for x in args.seeds.split(':'))
+    report = Report(party)
+    for result in simulate(party, parse_mobs(args.mobs), range(first, last), args.workers, search):
+        report.add(result)
+    for line in report.lines():
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Per-combat index of the creatures by board tile, for area queries."""
+
+
+class SpatialIndex:
+    """Creature on every board index, and bitmasks of the tiles held by each side.
+
+    Combat keeps it in sync as creatures are placed, moved, swapped, teleported,
+    summoned and killed. Queries are mask operations on the disks of the board:
+    Board.within_mask for euclidean radii, Board.disks for step counts."""
+    def __init__(self, board):
+        self.board = board
+        self.at = [None] * len(board)
+        self.occupied = 0
+        self.pc_mask = 0
+        self.mob_mask = 0
+
+    def add(self, creature, i):
+        bit = 1 << i
+        self.at[i] = creature
+        self.occupied |= bit
+        if creature.is_pc:
+            self.pc_mask |= bit
+        else:
+            self.mob_mask |= bit
+
+    def remove(self, creature, i):
+        bit = ~(1 << i)
+        self.at[i] = None
+        self.occupied &= bit
+        if creature.is_pc:
+            self.pc_mask &= bit
+        else:
+            self.mob_mask &= bit
+
+    def load(self, creatures):
+        """Indexes creatures, a tile -> creature dict, from scratch."""
+        self.at = [None] * len(self.board)
+        self.occupied = self.pc_mask = self.mob_mask = 0
+        for tile, creature in creatures.items():
+            self.add(creature, self.board.index[tile])
+
+    def side_mask(self, is_pc):
+        return self.pc_mask if is_pc else self.mob_mask
+
+    def creatures_of(self, mask):
+        """Creatures on the tiles of mask, in board order."""
+        creatures = []
+        while mask:
+            low = mask & -mask
+            creatures.append(self.at[low.bit_length() - 1])
+            mask ^= low
+        return creatures
+
+    def within(self, tile, radius, mask):
+        """Creatures on mask at most radius away from tile, in board order."""
+        return self.creatures_of(mask & self.board.within_mask(tile, radius))
+
+    def within_steps(self, i, steps, mask):
+        """Creatures on mask at most steps moves away from board index i, in board order."""
+        disks = self.board.disks[i]
+        return self.creatures_of(mask & disks[min(steps, len(disks) - 1)])
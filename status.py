@@ -1,14 +1,27 @@
-from display import SimpleSprite
 from math import ceil
+from events import StatusExpire
 
 
-class Status(SimpleSprite):
+class Status:
     def __init__(self, duration, name, image_name):
-        super().__init__(image_name)
         self.name = name
         self.image_name = image_name
-        self.duration = duration
+        self.expires_at = duration
+        self.clock = None
+
+    @property
+    def duration(self):
+        return self.expires_at - (self.clock.turn if self.clock else 0)
+
+    @duration.setter
+    def duration(self, duration):
+        self.expires_at = duration + (self.clock.turn if self.clock else 0)
 
+    def attach(self, creature):
+        """Pins the remaining duration to the combat clock of creature."""
+        duration = self.duration
+        self.clock = creature.combat
+        self.duration = duration
 
     def status_start(self, creature):
         pass
@@ -16,11 +29,16 @@ class Status(SimpleSprite):
     def status_end(self, creature):
         pass
 
-    def tick(self, creature, time):
-        self.duration -= time
-        if self.duration <= 0:
+    def next_wake(self):
+        """Combat time at which wake has something to do."""
+        return self.expires_at
+
+    def wake(self, creature, now):
+        if now >= self.expires_at:
             self.status_end(creature)
             creature.status.remove(self)
+            if creature.combat.events:
+                creature.combat.events.emit(StatusExpire(creature, self))
 
 
 class Bloodlust(Status):
@@ -36,18 +54,21 @@ class Bloodlust(Status):
 
 class Root(Status):
     def status_start(self, creature):
-        self.root_time = 0
+        self.next_pulse = creature.combat.turn + 100
         creature.rooted.append(self)
 
     def status_end(self, creature):
         creature.rooted.remove(self)
 
-    def tick(self, creature, time):
-        super().tick(creature, time)
-        self.root_time += time
-        if self.root_time >= 100:
-            creature.take_damage(4, 'true')
-            self.root_time -= 100 
+    def next_wake(self):
+        return min(self.expires_at, self.next_pulse)
+
+    def wake(self, creature, now):
+        super().wake(creature, now)
+        # At most one pulse per clock advance, even when it jumps past several
+        if now >= self.next_pulse:
+            creature.take_damage(4, 'true', self)
+            self.next_pulse += 100
 
     def get_description(self):
         return "Imobilized for %d turns. Gets small magical damage over time." % self.duration
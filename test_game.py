@@ -1,18 +1,36 @@
 from combat import *
+from creatures import DEFS
 from gametile import GameTile
+from board import Board
 from worldmap import *
 from items import HealthPotion
+from rng import RandomStreams
+from mcts import MCTS
+from env import CombatEnv, VectorEnv, SubprocVectorEnv, IDLE
+from encoder import Encoder, PLANES
+from simulate import parse_party, parse_mobs, fight, simulate, Report
+from kernel import Kernel, cross_check, new_combats
+from events import TurnStart, Move, Attack, Damage, Death
+from pathfinding import astar, PathCache
+import replay
+import display
+import pygame
 import mock
+import multiprocessing
+import pytest
+import subprocess
+import sys
 
 
-class FakeCombat:
+class FakeCombat(Combat):
+    MAP_RADIUS = 4.4
+
     def __init__(self):
-        self.creatures = {}
-        self.MAP_RADIUS = 4.4
+        super().__init__([], [])
 
 
 class TestGametile:
-    def setup(self):
+    def setup_method(self):
         self.t1 = GameTile(2, 2)
         self.t2 = GameTile(3, 4.5)
 
@@ -43,6 +61,46 @@ class TestGametile:
         assert self.t1 == t1_bis
         assert self.t2 != t1_bis
 
+    def test_tile_hex_dist(self):
+        t1 = GameTile(5, 2.5)
+        t2 = GameTile(3, 1.5)
+
+        assert t1.hex_dist(t2) == 2
+        assert all(self.t1.hex_dist(n) == 1 for n in self.t1.neighbours())
+
+    def test_tile_interned(self):
+        assert GameTile(3, 4.5) is self.t2
+        assert self.t1.neighbours()[1] is GameTile(2, 3)
+        assert self.t1 + GameTile(0, 0) is self.t1
+
+    def test_tile_hash_large_map(self):
+        tiles = [GameTile(i, j + (i % 2) / 2) for i in range(-60, 60) for j in range(-60, 60)]
+
+        assert len({hash(t) for t in tiles}) == len(tiles)
+
+    def test_all_tiles(self):
+        tiles = GameTile.all_tiles(6.4)
+
+        assert all(n in tiles for t in tiles for n in t.neighbours() if n.in_boundaries(6.4))
+        assert GameTile(7, 0.5) in tiles
+        assert GameTile(-7, 0.5) in tiles
+        assert len(tiles) == len(set(tiles))
+
+    def test_board(self):
+        board = Board.of_radius(6.4)
+
+        assert board is Board.of_radius(6.4)
+        for i, tile in enumerate(board.tiles):
+            assert board.index[tile] == i
+            for n, j in zip(tile.neighbours(), board.neighbours[i]):
+                assert j == -1 and not board.contains(n) or board.tiles[j] is n
+        assert board.distance(self.t1, self.t2) == self.t1.dist(self.t2)
+        for i in (0, board.index[GameTile(0, 0)], len(board) - 1):
+            assert board.reach(i, len(board)) == dict(enumerate(board.steps[i]))
+        assert board.on_edge[board.index[GameTile(7, 0.5)]]
+        assert not board.on_edge[board.index[GameTile(0, 0)]]
+        assert board.tiles_of(board.edge_mask) == [t for t in board.tiles if any(not board.contains(n) for n in t.neighbours())]
+
     def test_mouse_location(self):
         xt1, yt1 = self.t1.display_location()
 
@@ -109,6 +167,21 @@ class TestCreature:
         assert c1.next_action == 100
         assert c2.health == c2.maxhealth - c1.damage
 
+    def test_hooks(self):
+        c = Creature('Barbarian')
+        assert set(c.hooks) == {'on_tick', 'on_end_combat'}
+        c.set_passives([])
+        assert c.hooks == {}
+
+    def test_prototype(self):
+        definition = repr(DEFS['Wizard'])
+        c1 = Creature('Wizard')
+        c2 = Creature('Wizard')
+        c1.abilities[0].ready_at = 300
+        assert c2.abilities[0].ready_at == 0
+        assert c1.abilities[0] is not c2.abilities[0]
+        assert repr(DEFS['Wizard']) == definition
+
     def test_cleave(self):
         f = FakeCombat()
         c1 = Creature('Barbarian', is_pc=True)
@@ -143,13 +216,65 @@ class TestCreature:
 class TestCombat:
     def test_targets(self):
         c1 = Creature('Archer', is_pc=True)
-        g = Combat([(c1, (0, -3))], ['Skeleton'])
-
+        g = Combat([(c1, (0, -3))], ['Skeleton'], seed=0)
 
         targets = g.get_valid_targets(c1, c1.abilities[0])
 
         assert len(targets) == 1
 
+    def test_release(self):
+        c1 = Creature('Archer', is_pc=True)
+        g = Combat([(c1, (0, 3))], ['Troll'], seed=0)
+        troll = g.roster[1]
+        troll.take_damage(1000)
+        g.release()
+        assert g.roster == [c1]
+        hits = POOL.hits
+
+        g = Combat([(c1, (0, 3))], ['Troll'], seed=0)
+
+        assert POOL.hits == hits + 1
+        assert g.roster[1] is troll
+        assert troll.health == troll.maxhealth == Creature('Troll').health
+        assert troll in g.tickers
+
+    def test_reach(self):
+        c1 = Creature('Fighter', is_pc=True)
+        g = Combat([(c1, (0, 0))], [])
+        Creature('Skeleton').set_in_combat(g, GameTile(0, 1), 1)
+        board = g.board
+
+        reach = g.reach(c1)
+
+        assert reach[board.index[GameTile(0, 0)]] == 0
+        assert reach[board.index[GameTile(0, -2)]] == 2
+        assert board.index[GameTile(0, 1)] not in reach
+        assert reach[board.index[GameTile(1, 1.5)]] == 2
+        # Three moves around the skeleton
+        assert board.index[GameTile(0, 2)] not in reach
+        assert g.reach(c1) is reach
+        c1.free_moves = 0
+        assert max(g.reach(c1).values()) == 1
+
+    def test_spatial(self):
+        pcs = [Creature(defkey, is_pc=True) for defkey in ('Fighter', 'Barbarian', 'Archer', 'Wizard', 'Enchantress')]
+        g = Combat(zip(pcs, FORMATION), ['Skeleton'] * 3 + ['Necromancer'] * 2, seed=3)
+        g.new_turn()
+        board = g.board
+        for _ in range(150):
+            if g.is_over():
+                break
+            g.play(g.ai_action())
+            assert [c.tile if c else None for c in g.spatial.at] == \
+                [tile if tile in g.creatures else None for tile in board.tiles]
+            for creature in g.creatures.values():
+                enemies = [c for c in g.creatures.values() if c.is_pc != creature.is_pc]
+                for radius in (1.25, 2.25, 3.25):
+                    assert set(g.enemies_within(creature, radius)) == \
+                        {c for c in enemies if board.distance(creature.tile, c.tile) <= radius}
+                assert g.nearest_enemy(creature) is min(enemies, key=lambda c: creature.tile.dist(c.tile))
+        assert len(g.roster) > 10
+
     def test_range(self):
         c1 = Creature('Archer', is_pc=True)
         g = Combat([(c1, (0, 0))], [])
@@ -160,11 +285,524 @@ class TestCombat:
         assert GameTile(0, -2) in hint
         assert GameTile(1, -1.5) in hint
 
+    def test_los(self):
+        f = FakeCombat()
+        c1 = Creature('Archer', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c3 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 0)
+        c2.set_in_combat(f, GameTile(0, -3), 1)
+        c3.set_in_combat(f, GameTile(0, -1), 1)
+        arrow = c1.abilities[0]
+
+        assert not arrow.range_hint(c1, c2.tile)
+        assert c2.tile not in f.get_valid_targets(c1, arrow)
+
+        c3.move_or_attack(GameTile(1, -0.5))
+
+        assert arrow.range_hint(c1, c2.tile)
+        assert c2.tile in f.get_valid_targets(c1, arrow)
+
+    def test_masks(self):
+        f = FakeCombat()
+        c1 = Creature('Archer', is_pc=True)
+        c2 = Creature('Fighter', is_pc=True)
+        c3 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 0)
+        c2.set_in_combat(f, GameTile(0, 1), 0)
+        c3.set_in_combat(f, GameTile(0, -1), 0)
+
+        c1.move_or_attack(GameTile(0, 1))
+
+        assert f.pc_mask == f.board.mask([GameTile(0, 0), GameTile(0, 1)])
+        assert f.is_enemy_at(c1, GameTile(0, -1)) and f.is_ally_at(c1, GameTile(0, 0))
+        assert f.enemies_within(c2, 1) == [c3]
+        assert not f.is_over()
+
+        c3.take_damage(100)
+
+        assert f.mob_mask == 0 and f.occupied == f.pc_mask
+        assert f.is_over()
+
+    def test_ai_steps(self):
+        f = FakeCombat()
+        c1 = Creature('Fighter', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c3 = Creature('Skeleton', is_pc=False)
+        c4 = Creature('SkeletonArcher', is_pc=False)
+        c5 = Creature('Archer', is_pc=True)
+        c1.set_in_combat(f, GameTile(0, 2), 0)
+        c2.set_in_combat(f, GameTile(0, 0), 1)
+        c3.set_in_combat(f, GameTile(0, 1), 1)
+        c4.set_in_combat(f, GameTile(0, -3), 1)
+
+        assert f.nearest_enemy(c2) is c1
+        # A stronger ally in the way is not swapped with
+        c3.health = 100
+        assert c2.ai_action() == ('idle',)
+        c3.health = 10
+        assert c2.ai_action() == ('move', c3.tile)
+
+        # Out of range, the archer closes in
+        assert c4.ai_action() == ('move', GameTile(0, -2))
+
+        # Ties go to the enemy met first, then the archer backs off from it
+        c5.set_in_combat(f, GameTile(-1, -2.5), 0)
+        f.move_creature(c1, GameTile(1, -2.5))
+        assert f.nearest_enemy(c4) is c5
+        action = c4.ai_action()
+        assert action[0] == 'move' and action[1].dist(c5.tile) > c4.tile.dist(c5.tile)
+
+    def test_turn_order(self):
+        f = FakeCombat()
+        c1 = Creature('Archer', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c3 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 2)
+        c2.set_in_combat(f, GameTile(0, -3), 1)
+        c3.set_in_combat(f, GameTile(1, -3.5), 2)
+
+        assert f.timeline.upcoming(5) == [c2, c1, c3]
+
+        f.new_turn()
+        c2.idle()
+        f.new_turn()
+
+        assert f.to_act is c1
+        assert f.turn == 2
+        assert f.timeline.upcoming(2) == [c1, c3]
+
+    def test_dead_leave_timeline(self):
+        f = FakeCombat()
+        c1 = Creature('Archer', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 0)
+        c2.set_in_combat(f, GameTile(0, 1), 1)
+
+        c2.take_damage(100)
+
+        assert f.timeline.upcoming(5) == [c1]
+
+    def test_status_expiry(self):
+        f = FakeCombat()
+        c1 = Creature('Enchantress', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 0)
+        c2.set_in_combat(f, GameTile(0, -3), 1)
+        f.new_turn()
+
+        c1.use_ability(c1.abilities[0], c2.tile)
+        f.new_turn()
+        assert c2.rooted
+        assert c1.abilities[0].current_cooldown == 199
+
+        for _ in range(6):
+            f.to_act.idle()
+            f.new_turn()
+
+        assert f.turn == 301
+        assert not c2.rooted
+        assert c2.status == []
+        assert c2.health == c2.maxhealth - 12
+        assert c1.abilities[0].current_cooldown == 0
+
+    def test_seed(self):
+        fights = [Combat([], ['Skeleton'] * 6, seed=42), Combat([], ['Skeleton'] * 6, seed=42)]
+
+        assert list(fights[0].creatures) == list(fights[1].creatures)
+        assert list(Combat([], ['Skeleton'] * 6, seed=43).creatures) != list(fights[0].creatures)
+
+    def test_undo(self):
+        c1 = Creature('Enchantress', is_pc=True)
+        g = Combat([(c1, (0, 0))], ['Skeleton', 'Necromancer'], seed=3)
+        g.new_turn()
+        g.push()
+        before = [(c.tile, c.health, c.next_action) for c in g.roster]
+
+        for _ in range(12):
+            g.to_act.ai_play()
+            g.new_turn()
+        after = [(c.tile, c.health, c.next_action, c.status) for c in g.roster]
+        g.push()
+        g.pop()
+
+        assert [(c.tile, c.health, c.next_action, c.status) for c in g.roster] == after
+
+        g.pop()
+
+        assert [(c.tile, c.health, c.next_action) for c in g.roster] == before
+        assert list(g.creatures.values()) == g.roster
+        assert g.turn == 0 and c1.status == [] and c1.abilities[0].current_cooldown == 0
+        assert g.timeline.upcoming(3) == [g.to_act] + g.roster[1:]
+
+    def test_events(self):
+        g = Combat([(Creature('Fighter', is_pc=True), (0, 0))], ['Skeleton', 'SkeletonArcher'], seed=5)
+        events, deaths = [], []
+
+        assert not g.events
+
+        g.events.subscribe(events.append)
+        g.events.subscribe(deaths.append, Death)
+        g.new_turn()
+        while not g.is_over():
+            g.play(g.ai_action())
+
+        assert {TurnStart, Move, Attack, Damage, Death} <= {type(event) for event in events}
+        assert deaths == [event for event in events if type(event) is Death]
+        assert {event.creature for event in deaths} == {c for c in g.roster if c.health <= 0}
+        assert all(event.amount <= event.raw for event in events if type(event) is Damage)
+
+        count = len(events)
+        with g.events.muted():
+            g.events.emit(Death(g.roster[0]))
+
+        assert len(events) == count
+
+    def test_headless(self):
+        code = "import sys, combat; combat.Combat([], ['Skeleton']); assert 'pygame' not in sys.modules"
+
+        subprocess.check_call([sys.executable, '-c', code])
+
+
+class TestSearch:
+    def test_legal_actions(self):
+        f = FakeCombat()
+        c1 = Creature('Archer', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 0)
+        c2.set_in_combat(f, GameTile(0, -3), 1)
+        f.new_turn()
+        actions = f.legal_actions()
+
+        assert ('idle',) in actions
+        assert ('ability', 0, c2.tile) in actions
+        assert len([a for a in actions if a[0] == 'move']) == 6
+
+        f.play(('move', GameTile(0, 1)))
+
+        assert f.history == [('move', GameTile(0, 1))]
+        assert c1.tile == GameTile(0, 1)
+
+    def test_replay(self):
+        pcs = [Creature('Fighter', is_pc=True), Creature('Wizard', is_pc=True)]
+        g = Combat(zip(pcs, FORMATION), ['Skeleton'] * 3, seed=5)
+        g.new_turn()
+        for _ in range(20):
+            g.play(g.ai_action())
+
+        replayed = Combat.replay(g.setup, g.history)
+
+        assert [(t, c.name, c.health) for t, c in replayed.creatures.items()] == \
+               [(t, c.name, c.health) for t, c in g.creatures.items()]
+
+    def test_mcts(self):
+        pcs = [Creature('Fighter', is_pc=True), Creature('Wizard', is_pc=True)]
+        g = Combat(zip(pcs, FORMATION), ['Skeleton'] * 3, seed=5)
+        search = MCTS(budget_ms=5)
+        g.searchers = {False: search}
+        g.new_turn()
+        while g.to_act.is_pc:
+            g.play(g.ai_action())
+        action = g.ai_action()
+
+        assert action in g.legal_actions()
+        assert search.root.visits > 0
+        assert g.history == search.combat.history
+
+        child = search.root.children[action]
+        g.play(action)
+        search.move_root(g)
+
+        assert search.root is child
+        assert len(search.decision_times) == 1
+
+    def test_mcts_workers(self):
+        pcs = [Creature('Fighter', is_pc=True), Creature('Wizard', is_pc=True)]
+        g = Combat(zip(pcs, FORMATION), ['Skeleton'] * 3, seed=5)
+        search = MCTS(budget_ms=5, workers=2)
+        assert search.pool is not None
+        g.searchers = {False: search}
+        g.new_turn()
+        while g.to_act.is_pc:
+            g.play(g.ai_action())
+        try:
+            assert g.ai_action() in g.legal_actions()
+
+            # A worker past the deadline is not waited for
+            late = mock.Mock()
+            late.get.side_effect = multiprocessing.TimeoutError
+            with mock.patch.object(search, 'start_workers', return_value=[late]):
+                assert g.ai_action() in g.legal_actions()
+            assert late.get.call_args[1]['timeout'] <= 0.005
+        finally:
+            search.close()
+
+
+class TestEnv:
+    def test_step(self):
+        env = CombatEnv(mobs=['Skeleton'] * 2)
+        obs, info = env.reset(seed=1)
+        mask = info['action_mask']
+
+        assert len(mask) == env.action_count and mask[IDLE]
+        assert obs.shape == (len(PLANES), 15, 15)
+        assert obs[PLANES.index('to_act')].sum() == 1
+        assert env.combat.to_act.is_pc
+        for action in env.combat.legal_actions():
+            assert mask[env.encode(action)] and env.decode(env.encode(action)) == action
+
+        turn = env.combat.turn
+        obs, reward, terminated, truncated, info = env.step(IDLE)
+
+        assert env.combat.turn > turn and env.combat.to_act.is_pc
+        assert reward == 0 and not terminated and not truncated
+
+    def test_vector(self):
+        vector = VectorEnv(2, mobs=['Skeleton'], max_actions=5)
+        obs, infos = vector.reset(seed=3)
+        truncated = [False]
+        while not truncated[0]:
+            obs, rewards, terminated, truncated, infos = vector.step([IDLE, IDLE])
+
+        assert infos[0]['final_observation'] is not obs[0]
+        assert vector.seeds[0] == 5
+        assert vector.envs[0].actions < 5
+
+    def test_subprocess(self):
+        vector = VectorEnv(3, mobs=['Skeleton'])
+        subprocess_vector = SubprocVectorEnv(3, 2, mobs=['Skeleton'])
+        obs, _ = vector.reset(seed=1)
+        subprocess_obs, _ = subprocess_vector.reset(seed=1)
+        for _ in range(4):
+            obs, rewards, *_ = vector.step([0, 1, IDLE])
+            subprocess_obs, subprocess_rewards, *_ = subprocess_vector.step([0, 1, IDLE])
+
+        assert (obs == subprocess_obs).all()
+        assert rewards == subprocess_rewards
+        subprocess_vector.close()
+
+    def test_encoder(self):
+        f = FakeCombat()
+        c1 = Creature('Archer', is_pc=True)
+        c2 = Creature('Skeleton', is_pc=False)
+        c1.set_in_combat(f, GameTile(0, 0), 0)
+        c2.set_in_combat(f, GameTile(1, -0.5), 1)
+        encoder = Encoder(FakeCombat.MAP_RADIUS)
+        planes = encoder.encode(f)
+        bound = int(FakeCombat.MAP_RADIUS + 1)
+
+        assert planes[PLANES.index('on_board')].sum() == len(f.board)
+        assert planes[PLANES.index('ally'), bound, bound] == 1
+        assert planes[PLANES.index('enemy'), bound - 1, bound + 1] == 1
+
+        c1.move_or_attack(GameTile(0, 1))
+        c2.take_damage(30)
+        planes = encoder.encode(f)
+
+        assert planes[PLANES.index('occupied'), bound, bound] == 0
+        assert planes[PLANES.index('ally'), bound + 1, bound] == 1
+        assert planes[PLANES.index('health'), bound - 1, bound + 1] == 0.5
+        assert (planes == Encoder(FakeCombat.MAP_RADIUS).encode(f)).all()
+
+    def test_incremental_encoder(self):
+        pcs = [Creature(name, is_pc=True) for name in ('Fighter', 'Wizard', 'Enchantress')]
+        g = Combat(zip(pcs, FORMATION), ['Necromancer', 'Skeleton', 'SkeletonArcher', 'Troll'], seed=4)
+        g.new_turn()
+        kinds = set()
+        g.events.subscribe(lambda event: kinds.add(type(event).__name__))
+        encoder = Encoder(g.MAP_RADIUS)
+        encoder.encode(g)
+        snapshot = g.snapshot()
+        while not g.is_over():
+            g.play(g.ai_action())
+            assert (encoder.encode(g) == Encoder(g.MAP_RADIUS).encode(g)).all()
+        assert {'Move', 'Damage', 'Death', 'Summon', 'StatusApply', 'StatusExpire'} <= kinds
+
+        # Rewound, the combat is encoded in full
+        g.restore(snapshot)
+        assert (encoder.encode(g) == Encoder(g.MAP_RADIUS).encode(g)).all()
+
+
+class TestReplay:
+    def test_seek(self):
+        c1 = Creature('Enchantress', is_pc=True)
+        g = Combat([(c1, (0, 0))], ['Skeleton', 'Necromancer'], seed=3)
+        g.new_turn()
+        while not g.is_over():
+            g.play(g.ai_action())
+        r = replay.Replay(replay.dumps(g, interval=8))
+
+        assert r.actions == g.history
+        assert len(r.keyframes) == (len(g.history) - 1) // 8
+        for n in (0, 7, 8, 21, len(g.history)):
+            seeked, replayed = r.seek(n), Combat.replay(g.setup, g.history[:n])
+
+            assert replay.keyframe(seeked) == replay.keyframe(replayed)
+
+    def test_actions(self):
+        board = Board.of_radius(Combat.MAP_RADIUS)
+        actions = [('idle',), ('move', board.tiles[0]), ('move', board.tiles[-1]),
+                   ('ability', 0, board.tiles[5]), ('ability', 2, board.tiles[-1])]
+
+        assert [replay.decode_action(board, replay.encode_action(board, a)) for a in actions] == actions
+        assert replay.encode_action(board, ('move', GameTile(40, 40))) == replay.OFF_BOARD
+
+
+class TestRandomStreams:
+    def test_streams(self):
+        rng = RandomStreams('seed')
+        a = [rng['a'].random() for _ in range(3)]
+        rng['b'].random()
+
+        assert RandomStreams('seed')['a'].random() == a[0]
+        assert RandomStreams('seed').derive('x')['a'].random() != a[0]
+
+        loaded = RandomStreams.dict_load(json.loads(json.dumps(rng.dict_dump())))
+
+        assert loaded['a'].random() == rng['a'].random()
+        assert loaded['b'].random() == rng['b'].random()
+
+    def test_tell(self):
+        rng = RandomStreams('seed')
+        rng['a'].getrandbits(32 * 1000)
+        rng['a'].choice(range(5))
+        rng['b'].gauss()
+
+        assert rng.tell('a') == 1001
+        assert rng.tell('b') is None
+        assert RandomStreams.dict_load(rng.dict_dump())['a'].getstate() == rng['a'].getstate()
+
+
+class TestSimulate:
+    def test_parse(self):
+        assert parse_party('Fighter+Bloodluster,Archer') == [('Fighter', ['Bloodluster']), ('Archer', [])]
+        assert parse_mobs('Skeleton*2,Troll') == ['Skeleton', 'Skeleton', 'Troll']
+
+    def test_fight(self):
+        party = parse_party('Fighter,Barbarian,Archer,Wizard,Enchantress')
+        report = Report(party)
+        for result in simulate(party, ['Skeleton'] * 4, range(3)):
+            report.add(result)
+
+        assert fight(party, ['Skeleton'] * 4, 1) == fight(party, ['Skeleton'] * 4, 1)
+        assert report.fights == 3
+        assert report.wins + report.draws <= 3
+        assert report.damage['party', 'Fighter attack'] > 0
+        assert all(sum(histogram) == 3 for histogram in report.health)
+
+
+class TestKernel:
+    def test_cross_check(self):
+        party = parse_party('Fighter,Barbarian,Archer,Wizard')
+        assert cross_check(party, parse_mobs('Skeleton*3,SkeletonArcher*2,Troll,Gobelin'), range(12)) == []
+
+    def test_unsupported(self):
+        party = parse_party('Fighter,Enchantress')
+        with pytest.raises(ValueError):
+            Kernel(new_combats(party, ['Skeleton'], [0]))
+
+
+class TestPathfinding:
+    def test_astar(self):
+        start, goal = GameTile(0, 0), GameTile(0, 3)
+        wall = {GameTile(-1, 1.5), GameTile(0, 1), GameTile(1, 1.5)}
+
+        def passable(tile):
+            return tile.in_boundaries(5) and tile not in wall
+        path = astar(start, goal, passable)
+
+        assert path[-1] == goal
+        assert not wall & set(path)
+        assert all(a.hex_dist(b) == 1 for a, b in zip([start] + path, path))
+        assert len(path) == 5
+        assert astar(start, goal, lambda tile: passable(tile) and tile != goal) is None
+        assert astar(start, start, passable) == []
+
+    def test_cache(self):
+        cache = PathCache()
+        searched = []
+
+        def passable(tile):
+            searched.append(tile)
+            return tile.in_boundaries(5)
+        path = cache.path(GameTile(0, 0), GameTile(0, 3), passable, 0)
+        calls = len(searched)
+
+        assert cache.path(GameTile(0, 0), GameTile(0, 3), passable, 0) is path
+        assert len(searched) == calls
+        assert cache.path(GameTile(0, 0), GameTile(0, 3), passable, 1) == path
+        assert len(searched) == 2 * calls
+
+
+class TestDisplay:
+    def test_dirty_rects(self):
+        d = display.Display()
+        d.screen = pygame.Surface((960, 600))
+        with mock.patch('display.DISPLAY', d), mock.patch('pygame.display.update') as update, \
+                mock.patch('pygame.display.flip') as flip:
+            bg = display.SimpleSprite('menu.png')
+            sprite = display.SimpleSprite('icons/sword.png')
+            old = sprite.rect.copy()
+
+            def frame():
+                bg.display()
+                sprite.display()
+                d.present()
+            frame()
+            assert flip.call_count == 1
+            frame()
+            assert not update.called
+
+            sprite.move_to(100, 100)
+            frame()
+            rects = update.call_args[0][0]
+            assert flip.call_count == 1
+            assert old.unionall(rects) == old.union(sprite.rect)
+
+            d.full_redraw = True
+            frame()
+            assert flip.call_count == 2
+
+    def test_marks_without_frames(self):
+        d = display.Display()
+        for _ in range(1000):
+            d.mark((10, 10, 32, 32))
+            d.mark((12, 12, 8, 8))
+        assert d.marked == [pygame.Rect(10, 10, 32, 32)]
+
+        for i in range(1000):
+            d.mark((i % 900, 0, 1, 1 + i))
+        assert d.marked is None
+
+        d.screen = pygame.Surface(display.SCREEN_SIZE)
+        with mock.patch('pygame.display.flip') as flip:
+            d.present()
+        assert flip.called and d.marked == []
+
+    def test_surface_cache(self):
+        cache = display.SurfaceCache()
+        sword = cache.get('icons/sword.png')
+        assert cache.get('icons/sword.png') is sword
+        assert sword.get_size() == tuple(2 * x for x in display.SimpleSprite.load_image('icons/sword.png').get_size())
+        assert cache.get('icons/sword.png', scale=1) is not sword
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        # Room for two scaled icons: the least recently used one goes
+        cache = display.SurfaceCache(budget=2 * sword.get_pitch() * sword.get_height())
+        sword = cache.get('icons/sword.png')
+        arrow = cache.get('icons/arrow.png')
+        assert cache.get('icons/sword.png') is sword
+        cache.get('icons/armor.png')
+        assert cache.evictions == 1
+        assert cache.size <= cache.budget
+        assert cache.get('icons/sword.png') is sword
+        assert cache.get('icons/arrow.png') is not arrow
+
 
 class TestWorldMap:
     @mock.patch('worldmap.TextSprite', mock.MagicMock())
     @mock.patch('worldmap.SimpleSprite', mock.MagicMock())
-    def setup(self):
+    def setup_method(self, method):
         self.wm = WorldInterface(None)
 
     @mock.patch('worldmap.TextSprite', mock.MagicMock())
@@ -181,3 +819,46 @@ class TestWorldMap:
 
         assert self.wm.pc_list[0].health == self.wm.pc_list[0].maxhealth
         assert self.wm.inventory == []
+
+    @mock.patch('worldmap.TextSprite', mock.MagicMock())
+    @mock.patch('worldmap.SimpleSprite', mock.MagicMock())
+    def test_seeded_map(self):
+        self.wm.new_game(4, seed=7)
+        other = WorldInterface(None)
+        other.new_game(4, seed=7)
+
+        assert other.pc_position == self.wm.pc_position
+        assert {k: type(v) for k, v in other.map.board.items()} == {k: type(v) for k, v in self.wm.map.board.items()}
+
+    @mock.patch('worldmap.TextSprite', mock.MagicMock())
+    @mock.patch('worldmap.SimpleSprite', mock.MagicMock())
+    def test_travel(self):
+        self.wm.new_game(4, seed=7)
+        self.wm.map.update(self.wm.pc_position)
+        start = self.wm.pc_position
+        goal = max((tile for tile in self.wm.map.seen if type(self.wm.map.board[tile]) is MapTile),
+                   key=start.hex_dist)
+        food = self.wm.party_food
+
+        self.wm.route = list(self.wm.map.path(start, goal))
+        while self.wm.route:
+            self.wm.step(self.wm.route.pop(0))
+
+        assert self.wm.pc_position == goal
+        assert self.wm.party_food == food - len(self.wm.pc_list) * start.hex_dist(goal)
+
+    @mock.patch('worldmap.TextSprite', mock.MagicMock())
+    @mock.patch('worldmap.SimpleSprite', mock.MagicMock())
+    def test_click_outside_map(self):
+        self.wm.new_game(4, seed=7)
+        self.wm.map.update(self.wm.pc_position)
+        self.wm.inventory_display.on_click = mock.MagicMock()
+        self.wm.map.path = mock.MagicMock(return_value=None)
+        # A tile drawn under the inventory panel, were it seen
+        self.wm.map.seen.add(GameTile.get_tile_for_mouse((60, 390)))
+
+        self.wm.on_click((60, 390))
+
+        assert not self.wm.map.path.called
+        self.wm.on_click(self.wm.pc_position.neighbours()[1].display_location())
+        assert self.wm.map.path.called
@@ -0,0 +1,67 @@
+import heapq
+
+
+class Timeline:
+    """Creatures of a combat ordered by next_action.
+
+    Ties go to the creature that entered the combat first. Rescheduling pushes
+    a new entry and voids the previous one, which is dropped once it reaches
+    the top of the heap."""
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.arrival = {}
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, creature):
+        return creature in self.entries
+
+    def schedule(self, creature):
+        """Inserts creature, or moves it to its current next_action."""
+        self.remove(creature)
+        if creature not in self.arrival:
+            self.arrival[creature] = len(self.arrival)
+        self.sequence += 1
+        entry = [creature.next_action, self.arrival[creature], self.sequence, creature]
+        self.entries[creature] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, creature):
+        entry = self.entries.pop(creature, None)
+        if entry:
+            entry[-1] = None
+
+    def snapshot(self):
+        return tuple(tuple(entry) for entry in self.entries.values()), dict(self.arrival), self.sequence
+
+    def restore(self, snapshot):
+        entries, arrival, self.sequence = snapshot
+        self.entries = {entry[-1]: list(entry) for entry in entries}
+        self.heap = list(self.entries.values())
+        heapq.heapify(self.heap)
+        self.arrival = dict(arrival)
+
+    def peek(self):
+        """Next creature to act, or None if the timeline is empty."""
+        while self.heap and self.heap[0][-1] is None:
+            heapq.heappop(self.heap)
+        return self.heap[0][-1] if self.heap else None
+
+    def upcoming(self, number):
+        """The next number creatures to act, in order, without touching the heap.
+
+        Walks the heap best-first, so the cost depends on number and not on
+        the size of the combat."""
+        result = []
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier and len(result) < number:
+            entry, index = heapq.heappop(frontier)
+            if entry[-1] is not None:
+                result.append(entry[-1])
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+        return result
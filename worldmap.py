@@ -1,14 +1,21 @@
-from combat import CombatInterface
+from combat_ui import CombatInterface, CreatureSprite
+from combat import FORMATION
 from display import Interface, TextSprite, SimpleSprite, CascadeElement
 from creatures import Creature
 from pygame.locals import *
-import random
 import items
 import json
 import os
 from gametile import GameTile
+from rng import RandomStreams
+from pathfinding import PathCache
 import math
 
+# Updates between two steps of the party travelling to a clicked tile
+TRAVEL_FRAMES = 8
+# Screen area of the map, right of the party and inventory panels
+MAP_VIEWPORT = Rect(340, 0, 620, 600)
+
 
 class EquipInterface(Interface, CascadeElement):
     def __init__(self, father, item):
@@ -101,7 +108,8 @@ class TeammateDisplay(CascadeElement):
         super().__init__()
         self.basex, self.basey = basex, basey
         self.pc = creature
-        self.pc.rect.x, self.pc.rect.y = basex, basey
+        self.pc_sprite = CreatureSprite(creature)
+        self.pc_sprite.rect.x, self.pc_sprite.rect.y = basex, basey
         self.health_stat = TextSprite('', '#ffffff', basex + 38, basey + 4)
         self.inventory = [
             SimpleSprite('icons/icon-blank.png'),
@@ -111,22 +119,24 @@ class TeammateDisplay(CascadeElement):
         for i, sprite in enumerate(self.inventory):
             sprite.rect.x, sprite.rect.y = basex + 120 + 32 * i, basey
         for i, item in enumerate(self.pc.items):
-            item.rect.x, item.rect.y = self.inventory[i].rect.x, self.inventory[i].rect.y
-        self.subsprites = [self.pc, self.health_stat] + self.inventory + self.pc.items
+            sprite = SimpleSprite.of(item)
+            sprite.rect.x, sprite.rect.y = self.inventory[i].rect.x, self.inventory[i].rect.y
+        self.subsprites = [self.pc_sprite, self.health_stat] + self.inventory + [SimpleSprite.of(item) for item in self.pc.items]
 
     def update(self):
         if self.pc.health < 0:
             self.must_show = False
-        self.pc.rect.x, self.pc.rect.y = self.basex, self.basey
+        self.pc_sprite.rect.x, self.pc_sprite.rect.y = self.basex, self.basey
         self.health_stat.set_text("%s/%s" % (self.pc.health, self.pc.maxhealth))
-        for item in self.pc.items:
-            if item not in self.subsprites:
-                self.subsprites.append(item)
-        for item in self.subsprites[5:]:
-            if item not in self.pc.items:
-                self.subsprites.remove(item)
-        for i, item in enumerate(self.pc.items):
-            item.rect.x, item.rect.y = self.inventory[i].rect.x, self.inventory[i].rect.y
+        item_sprites = [SimpleSprite.of(item) for item in self.pc.items]
+        for sprite in item_sprites:
+            if sprite not in self.subsprites:
+                self.subsprites.append(sprite)
+        for sprite in self.subsprites[5:]:
+            if sprite not in item_sprites:
+                self.subsprites.remove(sprite)
+        for i, sprite in enumerate(item_sprites):
+            sprite.rect.x, sprite.rect.y = self.inventory[i].rect.x, self.inventory[i].rect.y
 
 
 class StatusDisplay(CascadeElement):
@@ -160,17 +170,19 @@ class StatusDisplay(CascadeElement):
             pc.update()
 
         for i, item in enumerate(self.worldinterface.inventory):
-            item.rect.x, item.rect.y = self.inventory[i].rect.x, self.inventory[i].rect.y
-            self.items.append(item)
-        for item in self.items.copy():
-            if item not in self.worldinterface.inventory:
-                self.items.remove(item)
+            sprite = SimpleSprite.of(item)
+            sprite.rect.x, sprite.rect.y = self.inventory[i].rect.x, self.inventory[i].rect.y
+            self.items.append(sprite)
+        inventory_sprites = [SimpleSprite.of(item) for item in self.worldinterface.inventory]
+        for sprite in self.items.copy():
+            if sprite not in inventory_sprites:
+                self.items.remove(sprite)
         self.subsprites = [self.gold_icon, self.gold_stat, self.day_text, self.food_icon, self.food_stat] + self.inventory + self.teammates + self.items
 
     def on_click(self, mouse_pos):
-        for sprite in self.worldinterface.inventory:
-            if sprite.rect.collidepoint(mouse_pos):
-                ei = EquipInterface(self.worldinterface, sprite)
+        for item in self.worldinterface.inventory:
+            if SimpleSprite.of(item).rect.collidepoint(mouse_pos):
+                ei = EquipInterface(self.worldinterface, item)
                 ei.activate()
                 ei.display()
                 self.worldinterface.desactivate()
@@ -178,7 +190,7 @@ class StatusDisplay(CascadeElement):
 
         for pc in self.worldinterface.pc_list:
             for item in pc.items:
-                if item.rect.collidepoint(mouse_pos):
+                if SimpleSprite.of(item).rect.collidepoint(mouse_pos):
                     item.unequip()
                     self.worldinterface.inventory.append(item)
 
@@ -213,8 +225,8 @@ class SkeletonTile(MapTile):
 
         mobs = ['Skeleton'] * num_skeletons + ['SkeletonArcher'] * num_archers + ['Necromancer'] * num_necro
         world_interface.start_combat(mobs=mobs)
-        world_interface.party_gold += random.randint(5 + world_interface.level // 2, 10 + world_interface.level * 2)
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.party_gold += world_interface.rng['loot'].randint(5 + world_interface.level // 2, 10 + world_interface.level * 2)
+        world_interface.map.clear(world_interface.pc_position)
 
     def display(self):
         MapTile.display(self)
@@ -232,9 +244,9 @@ class GobelinTile(MapTile):
         num_trolls = min(5, world_interface.level // 3)
         mobs = ['Gobelin'] * num_gobelins + ['Troll'] * num_trolls
         world_interface.start_combat(mobs=mobs)
-        world_interface.party_gold += random.randint(4 + world_interface.level // 2, 8 + world_interface.level * 2)
-        world_interface.party_food += random.randint(40, 100)
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.party_gold += world_interface.rng['loot'].randint(4 + world_interface.level // 2, 8 + world_interface.level * 2)
+        world_interface.party_food += world_interface.rng['loot'].randint(40, 100)
+        world_interface.map.clear(world_interface.pc_position)
 
     def display(self):
         MapTile.display(self)
@@ -251,8 +263,8 @@ class BansheeTile(MapTile):
         num_banshees = 2 + min(6, world_interface.level // 3)
         mobs = ['Banshee'] * num_banshees
         world_interface.start_combat(mobs=mobs)
-        world_interface.party_gold += random.randint(5 + world_interface.level, 10 + world_interface.level * 4)
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.party_gold += world_interface.rng['loot'].randint(5 + world_interface.level, 10 + world_interface.level * 4)
+        world_interface.map.clear(world_interface.pc_position)
 
     def display(self):
         MapTile.display(self)
@@ -267,11 +279,11 @@ class DemonTile(MapTile):
 
     def on_step(self, world_interface):
         num_demons = min(2, world_interface.level // 10)
-        num_imp = min(12, random.randint(0, world_interface.level // 2))
+        num_imp = min(12, world_interface.rng['encounters'].randint(0, world_interface.level // 2))
         mobs = ['Demon'] * num_demons + ['Imp'] * num_imp
         world_interface.start_combat(mobs=mobs)
-        world_interface.party_gold += random.randint(5 + world_interface.level, 10 + world_interface.level * 4)
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.party_gold += world_interface.rng['loot'].randint(5 + world_interface.level, 10 + world_interface.level * 4)
+        world_interface.map.clear(world_interface.pc_position)
 
     def display(self):
         MapTile.display(self)
@@ -283,8 +295,8 @@ class GoldTile(MapTile):
         super().__init__(tile, 'tiles/gold.png')
 
     def on_step(self, world_interface):
-        world_interface.party_gold += random.randint(5 + world_interface.level, 10 + world_interface.level * 3)
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.party_gold += world_interface.rng['loot'].randint(5 + world_interface.level, 10 + world_interface.level * 3)
+        world_interface.map.clear(world_interface.pc_position)
 
 
 class FoodTile(MapTile):
@@ -292,8 +304,8 @@ class FoodTile(MapTile):
         super().__init__(tile, 'tiles/apple.png')
 
     def on_step(self, world_interface):
-        world_interface.party_food += random.randint(40, 160)
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.party_food += world_interface.rng['loot'].randint(40, 160)
+        world_interface.map.clear(world_interface.pc_position)
 
 
 class ShopModal(Interface, CascadeElement):
@@ -306,7 +318,7 @@ class ShopModal(Interface, CascadeElement):
         self.item_texts = []
         father.desactivate()
         for i in range(3):
-            choice = random.choice( list(items.ITEMS.keys()) )
+            choice = father.rng['shop'].choice( list(items.ITEMS.keys()) )
             item_class = items.ITEMS[choice][0]
             item_args = items.ITEMS[choice][1]
             item = item_class(*item_args)
@@ -334,9 +346,10 @@ class ShopModal(Interface, CascadeElement):
 
     def update(self, mouse_pos):
         for i, item in enumerate(self.items):
-            item.rect.x, item.rect.y = 330, 300 + 40 * i
+            sprite = SimpleSprite.of(item)
+            sprite.rect.x, sprite.rect.y = 330, 300 + 40 * i
             self.item_texts[i] = TextSprite("[%d]: %s - %d gold" % (i + 1, item.name, item.shop_price), "#ffffff", 368, 304 + 40 * i)
-        self.subsprites = [self.bg, self.text] + self.items + self.item_texts
+        self.subsprites = [self.bg, self.text] + [SimpleSprite.of(item) for item in self.items] + self.item_texts
         self.father.update(mouse_pos)
         self.display()
 
@@ -348,7 +361,7 @@ class ShopTile(MapTile):
     def on_step(self, world_interface):
         sm = ShopModal(world_interface)
         sm.activate()
-        world_interface.map.board[world_interface.pc_position] = MapTile(world_interface.pc_position)
+        world_interface.map.clear(world_interface.pc_position)
 
 
 class WallTile(MapTile):
@@ -362,7 +375,7 @@ class StairTile(MapTile):
         super().__init__(tile, 'icons/stairs-icon.png')
 
     def on_step(self, world_interface):
-        world_interface.pc_position = world_interface.map.gen_random()
+        world_interface.pc_position = world_interface.map.gen_random(world_interface.level_rng(world_interface.level + 1))
         world_interface.pc_sprite.rect.x, world_interface.pc_sprite.rect.y = world_interface.pc_position.display_location()
         for cr in world_interface.pc_list:
             cr.health += math.ceil((cr.maxhealth - cr.health) * 25 / 100)
@@ -370,23 +383,23 @@ class StairTile(MapTile):
         world_interface.level += 1
 
 
-def rand_tile(game_tile, level):
+def rand_tile(game_tile, level, rng):
     empty_ratio = 0.5 + 0.4 / level
-    if random.random() < 0.02:
+    if rng.random() < 0.02:
         return ShopTile(game_tile)
-    if random.random() < 0.05:
+    if rng.random() < 0.05:
         return GoldTile(game_tile)
-    if random.random() < 0.05:
+    if rng.random() < 0.05:
         return FoodTile(game_tile)
-    if random.random() < empty_ratio:
+    if rng.random() < empty_ratio:
         return MapTile(game_tile)
     demon_ratio = min(0.25, (level - 10) / 10)
-    if random.random() < demon_ratio:
+    if rng.random() < demon_ratio:
         return DemonTile(game_tile)
     banshee_ratio = min(0.3, (level - 5) / 5)
-    if random.random() < banshee_ratio:
+    if rng.random() < banshee_ratio:
         return BansheeTile(game_tile)
-    if random.random() < 0.5:
+    if rng.random() < 0.5:
         return SkeletonTile(game_tile)
     return GobelinTile(game_tile)
 
@@ -397,27 +410,31 @@ class WorldMap(CascadeElement):
         self.board = {}
         self.seen = set()
         self.level = level
+        self.paths = PathCache()
+        # Changed with the board, for the cached paths
+        self.version = 0
 
-    def gen_room(self, tile):
+    def gen_room(self, tile, rng):
         self.board[tile] = WallTile(tile)
         for neighb in tile.neighbours():
-            self.board[neighb] = rand_tile(neighb, self.level)
+            self.board[neighb] = rand_tile(neighb, self.level, rng)
             for wall in neighb.neighbours():
                 if wall not in self.board:
                     self.board[wall] = WallTile(wall)
 
-    def gen_random(self):
+    def gen_random(self, rng):
+        self.version += 1
         self.board = {}
-        self.gen_room(GameTile(0, 0))
+        self.gen_room(GameTile(0, 0), rng)
         extremums = []
         for neighb in GameTile(0, 0).neighbours():
-            self.board[neighb + neighb] = rand_tile(neighb + neighb, self.level)
-            self.gen_room(neighb + neighb + neighb + neighb)
+            self.board[neighb + neighb] = rand_tile(neighb + neighb, self.level, rng)
+            self.gen_room(neighb + neighb + neighb + neighb, rng)
             extremums.append(neighb+neighb+neighb+neighb+neighb+neighb)
-        random_stair = random.choice(extremums)
+        random_stair = rng.choice(extremums)
         extremums.remove(random_stair)
         self.board[random_stair] = StairTile(random_stair)
-        pc_tile = random.choice(extremums)
+        pc_tile = rng.choice(extremums)
         pc_tile = GameTile(pc_tile.x * 5 / 6, pc_tile.y * 5 / 6)
         self.board[pc_tile] = MapTile(pc_tile)
         return pc_tile
@@ -429,6 +446,19 @@ class WorldMap(CascadeElement):
         self.seen |= set(seen_tiles)
         self.subsprites = [self.board[k] for k in self.seen]
 
+    def clear(self, tile):
+        """Empties tile, once what was there has been stepped on."""
+        self.board[tile] = MapTile(tile)
+        self.version += 1
+
+    def path(self, start, goal):
+        """Tiles to step on from start to goal through seen tiles, or None.
+
+        Only the goal may be a tile that does something when stepped on."""
+        def passable(tile):
+            return tile in self.seen and (tile == goal or type(self.board[tile]) is MapTile)
+        return self.paths.path(start, goal, passable, (self.version, len(self.seen)))
+
     def dict_dump(self):
         d = {}
         for k, v in self.board.items():
@@ -436,6 +466,7 @@ class WorldMap(CascadeElement):
         return d
 
     def load_dict(self, d):
+        self.version += 1
         for k, v in d.items():
             tile = GameTile.from_string(k)
             self.board[tile] = MapTile.from_list(v, tile)
@@ -469,13 +500,17 @@ class WorldInterface(Interface, CascadeElement):
         self.pc_sprite = SimpleSprite('tiles/Fighter.png')
         self.map = WorldMap(0)
         self.subsprites = [self.bg, self.inventory_display, self.map, self.pc_sprite, self.cursor]
-        self.formation = [ (-2, 4), (-1, 4.5), (0, 4), (1, 4.5), (2, 4), ]
+        self.formation = list(FORMATION)
+        # Tiles left to step on to reach the clicked tile
+        self.route = []
+        self.travel_frame = 0
         Interface.__init__(self, father, keys=[
             ('(up|down)(left|right)?', self.move),
             (K_ESCAPE, self.quit),
             ])
 
     def on_return(self, defunct=None):
+        self.route = []
         self.pc_list = [pc for pc in self.pc_list if pc.health > 0]
         if not self.pc_list:
             self.erase_save()
@@ -485,9 +520,16 @@ class WorldInterface(Interface, CascadeElement):
 
     def on_click(self, mouse_pos):
         self.inventory_display.on_click(mouse_pos)
+        if not MAP_VIEWPORT.collidepoint(mouse_pos):
+            return
+        tile = GameTile.get_tile_for_mouse(mouse_pos)
+        if tile in self.map.seen and tile != self.pc_position:
+            self.route = list(self.map.path(self.pc_position, tile) or ())
+            self.travel_frame = 0
 
-    def new_game(self, slot):
+    def new_game(self, slot, seed=None):
         self.slot = slot
+        self.rng = RandomStreams(seed)
         self.party_gold = 0
         self.party_food = 400
         self.level = 1
@@ -499,7 +541,11 @@ class WorldInterface(Interface, CascadeElement):
             Creature('Wizard', is_pc=True),
             Creature('Enchantress', is_pc=True),
         ]
-        self.pc_position = self.map.gen_random()
+        self.pc_position = self.map.gen_random(self.level_rng(self.level))
+
+    def level_rng(self, level):
+        """Generates the map of a level, whatever happened in the previous ones."""
+        return self.rng.derive('level%d' % level)['map']
 
     def display_choices(self):
         pass
@@ -513,8 +559,10 @@ class WorldInterface(Interface, CascadeElement):
             'upright': 5,
             'upleft': 3
         }
-        index = moves[key]
-        new_position = self.pc_position.neighbours()[index]
+        self.route = []
+        self.step(self.pc_position.neighbours()[moves[key]])
+
+    def step(self, new_position):
         if self.map.board[new_position].is_wall:
             return
         self.party_food -= len(self.pc_list)
@@ -527,6 +575,11 @@ class WorldInterface(Interface, CascadeElement):
         self.map.board[self.pc_position].on_step(self)
 
     def update(self, mouse_pos):
+        if self.route:
+            self.travel_frame += 1
+            if self.travel_frame >= TRAVEL_FRAMES:
+                self.travel_frame = 0
+                self.step(self.route.pop(0))
         self.inventory_display.update(mouse_pos)
         self.pc_sprite.rect.x, self.pc_sprite.rect.y = self.pc_position.display_location()
         self.map.update(self.pc_position)
@@ -536,7 +589,7 @@ class WorldInterface(Interface, CascadeElement):
 
     def start_combat(self, mobs):
         self.save_game()
-        gi = CombatInterface(self, mobs)
+        gi = CombatInterface(self, mobs, self.rng['combat'].getrandbits(64))
         gi.activate()
         self.desactivate()
 
@@ -550,7 +603,8 @@ class WorldInterface(Interface, CascadeElement):
                 'level': self.level,
                 'map':self.map.dict_dump(),
                 'inventory_dump': inventory_dump,
-                'pc_position':self.pc_position.dict_dump()
+                'pc_position':self.pc_position.dict_dump(),
+                'rng': self.rng.dict_dump(),
                 }
         with open('save%d.json' % self.slot, 'w') as f:
             f.write(json.dumps(save))
@@ -573,6 +627,8 @@ class WorldInterface(Interface, CascadeElement):
         self.pc_position = GameTile.from_string(d['pc_position'])
         self.level = d['level']
         self.party_food = d['food']
+        # Saves made before seeded runs start a fresh random run
+        self.rng = RandomStreams.dict_load(d['rng']) if 'rng' in d else RandomStreams()
         self.map.level = self.level
         for key in d['inventory_dump']:
             item_class = items.ITEMS[key][0]